@@ -0,0 +1,83 @@
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+# Joins texts for a single pass, must never appear inside a pattern
+TEXT_SEPARATOR = "\n"
+
+
+class BlacklistScanner:
+    """
+    An Aho-Corasick automaton over the blacklist, finding every blacklisted substring of a text in one linear pass
+    regardless of how many patterns there are.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[List[str]] = [[]]
+
+        for pattern in patterns:
+            pattern = pattern.lower()
+            if pattern and TEXT_SEPARATOR not in pattern:
+                self.insert(pattern)
+        self.build_links()
+
+    def __len__(self) -> int:
+        return len(self.goto)
+
+    def insert(self, pattern: str):
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[node][char] = next_node
+            node = next_node
+        if pattern not in self.outputs[node]:
+            self.outputs[node].append(pattern)
+
+    def build_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                # Any pattern ending at the fail target also ends here
+                self.outputs[child] = (
+                    self.outputs[child] + self.outputs[self.fail[child]]
+                )
+
+    def scan(self, text: str) -> List[Set[str]]:
+        """
+        Returns the blacklisted patterns found in each line of 'text'.
+        """
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        hits: List[Set[str]] = [set()]
+        node = 0
+        for char in text.lower():
+            if char == TEXT_SEPARATOR:
+                hits.append(set())
+                node = 0
+                continue
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                hits[-1].update(outputs[node])
+        return hits
+
+    def scan_texts(self, texts: List[str]) -> List[Set[str]]:
+        """
+        Scans every text in a single pass, returning the blacklisted patterns found in each.
+        """
+        if not texts:
+            return []
+        cleaned = [text.replace(TEXT_SEPARATOR, " ") for text in texts]
+        return self.scan(TEXT_SEPARATOR.join(cleaned))
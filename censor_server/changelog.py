@@ -0,0 +1,111 @@
+import asyncio
+import json
+from bisect import bisect_right
+from pathlib import Path
+from typing import List, Optional, TypedDict
+
+import aiofiles
+from utils import do_log
+
+
+class ChangelogEntry(TypedDict):
+    version: int
+    word: str
+    is_username: bool
+
+
+class Changelog:
+    """
+    An append-only log of whitelist additions, keyed by the version each addition produced. Stored as one JSON
+    object per line so appending never rewrites the file.
+    - `floor_version` is the oldest version a client can be on and still be brought up to date from the log.
+    Anything older has been compacted away, and requires a full snapshot.
+    - Entries are recorded in memory as their versions are assigned, and written out by `write`, in that same order
+    however the writes interleave.
+    """
+
+    def __init__(self, path: Path, current_version: int, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries: List[ChangelogEntry] = []
+        self.versions: List[int] = []
+        self.floor_version = current_version
+        self.current_version = current_version
+        self.unwritten: List[ChangelogEntry] = []
+        self.write_lock = asyncio.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path.exists():
+            self.path.touch()
+            return
+
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    self.entries.append(json.loads(line))
+        self.versions = [entry["version"] for entry in self.entries]
+
+        if not self.entries:
+            return
+        if self.versions[-1] != self.current_version:
+            # The datasets were changed without the log, so none of it can be trusted
+            do_log(
+                f"[Changelog ends at v{self.versions[-1]}, data is at v{self.current_version}. Discarding log.]"
+            )
+            self.entries = []
+            self.versions = []
+            self.rewrite()
+            return
+
+        self.floor_version = self.versions[0] - 1
+        do_log(
+            f"Loaded {self.path.as_posix()} (v{self.floor_version} -> v{self.current_version})"
+        )
+
+    def rewrite(self):
+        with open(self.path, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in self.entries)
+
+    def record_many(self, entries: List[ChangelogEntry]):
+        """
+        Adds entries to the log. Must be called as their versions are assigned, before anything else can record
+        later ones, so the log stays sorted for `since`.
+        """
+        self.entries.extend(entries)
+        self.versions.extend(entry["version"] for entry in entries)
+        self.current_version = entries[-1]["version"]
+        self.unwritten.extend(entries)
+
+    async def write(self):
+        """
+        Appends every recorded entry not yet on disk. Writes take turns, so the file stays in version order too.
+        """
+        async with self.write_lock:
+            entries, self.unwritten = self.unwritten, []
+            if entries:
+                async with aiofiles.open(self.path, "a") as f:
+                    await f.write(
+                        "".join(json.dumps(entry) + "\n" for entry in entries)
+                    )
+
+            # Compact in bulk rather than on every append, so the rewrite cost is amortized
+            if len(self.entries) >= self.max_entries * 2:
+                self.compact()
+
+    def compact(self):
+        self.entries = self.entries[-self.max_entries :]
+        self.versions = self.versions[-self.max_entries :]
+        self.floor_version = self.versions[0] - 1
+        # The rewrite covers anything recorded but not yet written
+        self.unwritten = []
+        self.rewrite()
+        do_log(f"[Compacted changelog to v{self.floor_version}]")
+
+    def since(self, version: int) -> Optional[List[ChangelogEntry]]:
+        """
+        Returns every entry after 'version', or None if the log can't cover it and a snapshot is required.
+        """
+        if version < self.floor_version or version > self.current_version:
+            return None
+        return self.entries[bisect_right(self.versions, version) :]
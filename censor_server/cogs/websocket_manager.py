@@ -1,18 +1,32 @@
 import asyncio
 import json
-from asyncio import sleep as async_sleep
+import logging
 from enum import Enum
+from functools import partial
+from math import ceil
 from time import time
-from typing import Callable, Set
+from traceback import format_exc
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import websockets
+from connections import ConnectionRegistry
 from discord.ext import commands  # type: ignore
-from utils import BotClass, do_log
+from health import LoopLagMonitor
+from rate_limit import BucketConfig, RateLimiter
+from request_queue import QueueSlot, RequestJob, RequestQueue
+from snapshot_stream import SnapshotBlob
+from utils import BotClass, do_log, log_error
+from websockets.exceptions import ConnectionClosed
 
 
 class WSFunction(str, Enum):
     AUTH = "AUTH"
     WHITELIST_REQUEST = "WHITELIST_REQUEST"
+    CHECK_TEXT = "CHECK_TEXT"
+    SYNC_SINCE = "SYNC_SINCE"
+    GET_SNAPSHOT = "GET_SNAPSHOT"
+    GET_FILTER = "GET_FILTER"
+    HEALTH = "HEALTH"
 
 
 class WSResponse(str, Enum):
@@ -20,79 +34,365 @@ class WSResponse(str, Enum):
     AUTH_SUCCESS = "AUTH_SUCCESS"
     AUTH_FAIL = "AUTH_FAIL"
     WHITELIST_UPDATE = "WHITELIST_UPDATE"
+    SYNC_DELTA = "SYNC_DELTA"
+    SNAPSHOT_REQUIRED = "SNAPSHOT_REQUIRED"
+    REQUEST_QUEUED = "REQUEST_QUEUED"
+    REQUEST_POSTED = "REQUEST_POSTED"
+    REQUEST_FAILED = "REQUEST_FAILED"
+    REQUEST_RESOLVED = "REQUEST_RESOLVED"
+    SNAPSHOT_CHUNK = "SNAPSHOT_CHUNK"
+    SNAPSHOT = "SNAPSHOT"
+    FILTER = "FILTER"
+    HEALTH = "HEALTH"
+    RATE_LIMITED = "RATE_LIMITED"
+    ERROR = "ERROR"
 
 
 class WSManager:
     def __init__(
-        self, server_id: str, valid_ids: Set[str], request_whitelist_func: Callable
+        self,
+        server_id: str,
+        valid_ids: Set[str],
+        request_whitelist_func: Callable,
+        triage_request_func: Callable,
+        check_text_func: Callable,
+        sync_since_func: Callable,
+        get_snapshot_func: Callable,
+        get_filter_func: Callable,
+        health_func: Callable,
+        request_workers: int = 2,
+        max_in_flight: int = 8,
+        function_concurrency: Optional[Dict[str, int]] = None,
+        broadcast_window_ms: int = 250,
+        max_queued_broadcasts: int = 256,
+        idle_timeout_seconds: float = 0,
+        max_outstanding_requests: int = 0,
+        rate_limits: Optional[Dict[str, BucketConfig]] = None,
+        client_rate_limits: Optional[Dict[str, Dict[str, BucketConfig]]] = None,
+        health_client_ids: Optional[Set[str]] = None,
     ):
         self.server_id = server_id
-        self.connections: Set[str] = set()
+        self.connections = ConnectionRegistry(
+            max_queued_broadcasts, idle_timeout_seconds
+        )
         self.valid_ids = valid_ids
+        # Ids that may only call HEALTH, so monitoring doesn't share a client's identity or rate limits
+        self.health_client_ids = set(health_client_ids or ())
         self.request_whitelist_func = request_whitelist_func
+        self.request_queue = RequestQueue(
+            request_whitelist_func, request_workers, max_outstanding_requests
+        )
+        self.rate_limiter = RateLimiter(rate_limits, client_rate_limits)
+        self.refused_queue_full = 0
+        self.triage_request_func = triage_request_func
+        self.check_text_func = check_text_func
+        self.sync_since_func = sync_since_func
+        self.get_snapshot_func = get_snapshot_func
+        self.get_filter_func = get_filter_func
+        self.health_func = health_func
+
+        # Per-connection cap on messages being processed at once, and server-wide caps per function
+        self.max_in_flight = max_in_flight
+        self.function_limits: Dict[str, asyncio.Semaphore] = {
+            func: asyncio.Semaphore(limit)
+            for func, limit in (function_concurrency or {}).items()
+        }
+
+        # Approvals are coalesced over a short window and broadcast as a single frame, keyed by the version each
+        # produced since they can be queued out of order
+        self.broadcast_window = broadcast_window_ms / 1000
+        self.pending_updates: Dict[int, Dict] = {}
+        self.broadcast_task: Optional[asyncio.Task] = None
+
+    async def send(self, websocket, data):
+        """
+        Sends a direct reply, counted against the connection it goes to. Broadcasts go through `ConnectionRegistry`.
+        """
+        await websocket.send(data)
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.record_sent(data)
 
-    async def process_message(self, websocket, raw_message):
+    async def process_message(self, websocket, raw_message) -> Optional[str]:
+        """
+        Handles a single message, returning the sender's client id, or None if the connection was closed instead.
+        """
         try:
             message = json.loads(raw_message)
         except Exception:
             await websocket.close(code=1003, reason="Invalid JSON")
-            return
+            return None
 
         client_id = message.get("id")
-        if client_id not in self.valid_ids:
+        func = message.get("function")
+        if client_id not in self.valid_ids and not (
+            client_id in self.health_client_ids and func == WSFunction.HEALTH
+        ):
             await websocket.close(code=1003, reason="Invalid Auth")
-            return
+            return None
 
-        func = message.get("function")
         if func not in WSFunction.__members__:
             await websocket.close(code=1003, reason="Invalid Function")
-            return
+            return None
 
         backup_timestamp = f"servermsg_{str(time()).replace('.','')}"
         timestamp = message.get("timestamp", backup_timestamp)
+
+        # Discord-bound work is capped globally, everything else per client and function. HEALTH is never limited,
+        # a refused probe would look like an unhealthy bot. A whitelist request holds its queue slot from before
+        # triage until it's submitted, so requests pipelined meanwhile can't all pass the check and overfill the queue.
+        retry_after: float = 0
+        slot: Optional[QueueSlot] = None
+        if func == WSFunction.WHITELIST_REQUEST:
+            slot = self.request_queue.reserve()
+            if slot is None:
+                retry_after = self.request_queue.retry_after()
+                self.refused_queue_full += 1
+        if not retry_after and func != WSFunction.HEALTH:
+            retry_after = self.rate_limiter.check(client_id, func)
+
+        function_limit = self.function_limits.get(func)
+        response_data: Optional[Dict]
+        try:
+            if retry_after:
+                do_log(
+                    f"[WS] Rate limited {func} from {client_id}, retry after {retry_after:.2f}s",
+                    logging.DEBUG,
+                )
+                response_message = WSResponse.RATE_LIMITED
+                response_data = {
+                    "function": func,
+                    "retry_after_ms": ceil(retry_after * 1000),
+                }
+            else:
+                try:
+                    if function_limit is None:
+                        response_message, response_data = await self.run_function(
+                            websocket, client_id, timestamp, func, message, slot
+                        )
+                    else:
+                        async with function_limit:
+                            (
+                                response_message,
+                                response_data,
+                            ) = await self.run_function(
+                                websocket, client_id, timestamp, func, message, slot
+                            )
+                except ConnectionClosed:
+                    raise
+                except Exception:
+                    # The client still gets an answer for this timestamp, rather than waiting on it forever
+                    log_error(f"[WS] {func} from {client_id} failed\n{format_exc()}")
+                    response_message = WSResponse.ERROR
+                    response_data = {"function": func}
+        finally:
+            # Given back if the request was refused, failed, or had nothing left to post
+            if slot is not None:
+                slot.release()
+
+        response = {
+            "id": client_id,
+            "timestamp": timestamp,
+            "message": response_message,
+        }
+        if response_data is not None:
+            response["data"] = response_data
+        await self.send(websocket, json.dumps(response))
+        return client_id
+
+    async def run_function(
+        self,
+        websocket,
+        client_id: str,
+        timestamp: str,
+        func: str,
+        message: Dict,
+        slot: Optional[QueueSlot] = None,
+    ) -> Tuple[WSResponse, Optional[Dict]]:
         response_message = WSResponse.COMPLETE
+        response_data: Optional[Dict] = None
 
         if func == WSFunction.AUTH:
             do_log(f"[WS] Authed {client_id}")
             response_message = WSResponse.AUTH_SUCCESS
         elif func == WSFunction.WHITELIST_REQUEST:
-            data = message.get("data")
-            do_log(f"[WS] Whitelist Request: \n{data}\n")
-            await self.request_whitelist_func(data)
+            data = message.get("data", {})
+            # Words already whitelisted, recently rejected or pending are answered here, only new ones are queued
+            triage = await self.triage_request_func(data)
+            response_data = {
+                "whitelisted": triage["whitelisted"],
+                "rejected": triage["rejected"],
+                "pending": triage["pending"],
+            }
+            if triage["requests"]:
+                data = {**data, "requests": triage["requests"]}
+                job_id = self.request_queue.submit(
+                    data,
+                    partial(self.notify_request_done, websocket, client_id, timestamp),
+                    slot,
+                )
+                response_message = WSResponse.REQUEST_QUEUED
+                response_data["job_id"] = job_id
+                response_data["queue_depth"] = self.request_queue.depth
+                do_log(
+                    f"[WS] Queued whitelist request {job_id} (depth {self.request_queue.depth})"
+                )
+                do_log(f"[WS] Request {job_id} payload: \n{data}\n", logging.DEBUG)
+            else:
+                response_message = WSResponse.REQUEST_RESOLVED
+        elif func == WSFunction.CHECK_TEXT:
+            response_data = self.check_text_func(message.get("data", {}))
+        elif func == WSFunction.SYNC_SINCE:
+            response_data = self.sync_since_func(message.get("data", {}))
+            response_message = (
+                WSResponse.SNAPSHOT_REQUIRED
+                if response_data is None
+                else WSResponse.SYNC_DELTA
+            )
+        elif func == WSFunction.GET_SNAPSHOT:
+            # Chunks are streamed first, the closing response carries what's needed to verify them
+            blob: SnapshotBlob = await self.get_snapshot_func()
+            for index, chunk in enumerate(blob.chunks):
+                await self.send(
+                    websocket,
+                    json.dumps(
+                        {
+                            "id": client_id,
+                            "timestamp": timestamp,
+                            "message": WSResponse.SNAPSHOT_CHUNK,
+                            "data": {"index": index, "chunk": chunk},
+                        }
+                    ),
+                )
+            response_message = WSResponse.SNAPSHOT
+            response_data = blob.metadata()
+        elif func == WSFunction.GET_FILTER:
+            # The filter goes out as a single binary frame, followed by its metadata and exception list
+            filter_data, response_data = await self.get_filter_func()
+            await self.send(websocket, filter_data)
+            response_message = WSResponse.FILTER
+        elif func == WSFunction.HEALTH:
+            response_message = WSResponse.HEALTH
+            response_data = {
+                **self.health_func(),
+                "connections": self.connections.stats(),
+                "request_queue": self.request_queue.stats(),
+                "rate_limited": self.rate_limiter.limited,
+                "refused_queue_full": self.refused_queue_full,
+            }
+
+        return response_message, response_data
 
+    async def notify_request_done(
+        self, websocket, client_id: str, timestamp: str, job: RequestJob, success: bool
+    ):
         response = {
             "id": client_id,
             "timestamp": timestamp,
-            "message": response_message,
+            "message": WSResponse.REQUEST_POSTED
+            if success
+            else WSResponse.REQUEST_FAILED,
+            "data": {"job_id": job.job_id, "wait_ms": round(job.wait_time * 1000)},
         }
-        await websocket.send(json.dumps(response))
+        try:
+            await self.send(websocket, json.dumps(response))
+        except ConnectionClosed:
+            pass
+
+    async def handle_message(self, websocket, raw_message):
+        try:
+            await self.process_message(websocket, raw_message)
+        except ConnectionClosed:
+            pass
 
     async def ws_handler(self, websocket):
-        raw_data = await websocket.recv()
-        await self.process_message(websocket, raw_data)
-        self.connections.add(websocket)
+        try:
+            raw_data = await websocket.recv()
+            client_id = await self.process_message(websocket, raw_data)
+        except ConnectionClosed:
+            return
+        if client_id is None or client_id not in self.valid_ids:
+            # Health-only clients get their one answer, they're not sent broadcasts
+            return
+        connection = self.connections.register(websocket, client_id)
 
+        # Messages are pipelined, clients match responses to requests by their `timestamp`
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks: Set[asyncio.Task] = set()
         try:
             async for raw_message in websocket:
-                do_log("[WS] Processing message")
-                await self.process_message(websocket, raw_message)
+                do_log("[WS] Processing message", logging.DEBUG)
+                connection.touch()
+                await in_flight.acquire()
+                task = asyncio.create_task(self.handle_message(websocket, raw_message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: in_flight.release())
+        except ConnectionClosed:
+            pass
+        finally:
+            # Covers clean closes too, such as health probes
+            self.connections.unregister(websocket)
 
-                await async_sleep(0)
-        except websockets.exceptions.ConnectionClosedError:
-            self.connections.remove(websocket)
+        do_log(
+            f"[WS] {client_id} disconnected ({connection.stats()}, {len(self.connections)} still connected)",
+            logging.DEBUG,
+        )
 
-        do_log("[WS] Handler passed")
+    async def broadcast_update(self, word: str, is_username: bool, version: int):
+        """
+        Queues an update for the next broadcast frame. 'version' is the dataset version this update produced.
+        """
+        await self.broadcast_updates([(word, is_username)], version - 1, version)
 
-    async def broadcast_update(self, word: str, is_username: bool):
-        timestamp = f"servermsg_{str(time()).replace('.','')}"
-        message = {
-            "id": self.server_id,
-            "timestamp": timestamp,
-            "message": WSResponse.WHITELIST_UPDATE,
-            "data": {"word": word, "is_username": is_username},
-        }
-        websockets.broadcast(self.connections, json.dumps(message))  # type: ignore
-        do_log(f"[WS] Broadcast {message['data']}")
+    async def broadcast_updates(
+        self, updates: List[Tuple[str, bool]], from_version: int, to_version: int
+    ):
+        """
+        Queues a batch of updates for the next broadcast frame, that took the datasets from 'from_version' to
+        'to_version', one version each.
+        """
+        if to_version - from_version != len(updates):
+            raise ValueError(
+                f"{len(updates)} updates can't cover v{from_version} -> v{to_version}"
+            )
+        for version, (word, is_username) in enumerate(updates, from_version + 1):
+            self.pending_updates[version] = {"word": word, "is_username": is_username}
+
+        if self.broadcast_task is None or self.broadcast_task.done():
+            self.broadcast_task = asyncio.create_task(self.flush_updates())
+
+    async def flush_updates(self):
+        await asyncio.sleep(self.broadcast_window)
+        pending, self.pending_updates = self.pending_updates, {}
+
+        # Each run of consecutive versions goes out as its own frame. Clients on a frame's `from_version` can apply
+        # it as-is, anyone else should SYNC_SINCE instead.
+        runs: List[List[int]] = []
+        for version in sorted(pending):
+            if runs and version == runs[-1][-1] + 1:
+                runs[-1].append(version)
+            else:
+                runs.append([version])
+        for versions in runs:
+            from_version, to_version = versions[0] - 1, versions[-1]
+            timestamp = f"servermsg_{str(time()).replace('.','')}"
+            message = {
+                "id": self.server_id,
+                "timestamp": timestamp,
+                "message": WSResponse.WHITELIST_UPDATE,
+                "data": {
+                    "from_version": from_version,
+                    "to_version": to_version,
+                    "updates": [pending[version] for version in versions],
+                },
+            }
+            evicted = self.connections.broadcast(json.dumps(message))
+            do_log(
+                f"[WS] Broadcast {len(versions)} updates "
+                f"(v{from_version} -> v{to_version}) to {len(self.connections)} connections"
+                + (f", closed {evicted} slow consumers" if evicted else "")
+            )
 
 
 class WebsocketManagerCog(commands.Cog):
@@ -101,20 +401,67 @@ class WebsocketManagerCog(commands.Cog):
         server_id: str = self.bot.CFG["ws_server_id"]
         self.server_ip: str = self.bot.CFG.get("ws_server_ip", "127.0.0.1")
         authorized_clients: Set[str] = self.bot.CFG.get("ws_authorized_clients", set())
-        request_whitelist_func = self.bot.client.get_cog(
-            "WhitelistCog"
-        ).request_whitelist
+        whitelist_cog = self.bot.client.get_cog("WhitelistCog")
         self.ws_manager = WSManager(
-            server_id, authorized_clients, request_whitelist_func
+            server_id,
+            authorized_clients,
+            whitelist_cog.request_whitelist,
+            whitelist_cog.triage_request,
+            whitelist_cog.check_text,
+            whitelist_cog.sync_since,
+            whitelist_cog.get_snapshot,
+            whitelist_cog.get_filter,
+            self.health,
+            self.bot.CFG.get("request_workers", 2),
+            self.bot.CFG.get("ws_max_in_flight", 8),
+            self.bot.CFG.get("ws_function_concurrency", {}),
+            self.bot.CFG.get("ws_broadcast_window_ms", 250),
+            self.bot.CFG.get("ws_max_queued_broadcasts", 256),
+            self.bot.CFG.get("ws_idle_timeout_seconds", 0),
+            self.bot.CFG.get("max_outstanding_requests", 0),
+            self.bot.CFG.get("ws_rate_limits", {}),
+            self.bot.CFG.get("ws_client_rate_limits", {}),
+            self.bot.CFG.get("ws_health_clients", []),
+        )
+        # Dead connections are found by ping/pong heartbeats, None turns them off
+        self.ping_interval: Optional[float] = self.bot.CFG.get(
+            "ws_ping_interval_seconds", 20
         )
+        self.ping_timeout: Optional[float] = self.bot.CFG.get(
+            "ws_ping_timeout_seconds", 20
+        )
+        # permessage-deflate is opt-in, the update frames are small and it costs memory per connection
+        self.compression: Optional[str] = (
+            "deflate" if self.bot.CFG.get("ws_compression", False) else None
+        )
+        self.started_at = time()
+        self.lag_monitor = LoopLagMonitor(
+            self.bot.CFG.get("health_lag_interval_ms", 500)
+        )
+        self.lag_monitor.start()
         self.ws_server_task = asyncio.create_task(self.ws_init())
 
+    def health(self) -> Dict:
+        return {
+            "ready": self.bot.ready,
+            "discord_initialized": self.bot.discord_initialized,
+            "version": self.bot.client.get_cog("WhitelistCog").datasets["version"],
+            "loop_lag_ms": round(self.lag_monitor.lag * 1000, 1),
+            "max_loop_lag_ms": round(self.lag_monitor.max_lag * 1000, 1),
+            "uptime_s": round(time() - self.started_at),
+        }
+
     async def ws_init(self):
         while True:
             do_log("[WS] Starting server")
             try:
                 async with websockets.serve(
-                    self.ws_manager.ws_handler, self.server_ip, 8087
+                    self.ws_manager.ws_handler,
+                    self.server_ip,
+                    8087,
+                    compression=self.compression,
+                    ping_interval=self.ping_interval,
+                    ping_timeout=self.ping_timeout,
                 ):
                     do_log("[WS] Server started")
                     await asyncio.Future()  # run forever
@@ -1,14 +1,59 @@
+import asyncio
 import json
 from asyncio import sleep as async_sleep
 from enum import Enum
+from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Optional, Set, TypedDict, cast
+from time import perf_counter, time
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+    Union,
+    cast,
+)
 
-import aiofiles
+from blacklist_scanner import BlacklistScanner
+from changelog import Changelog
 from cogs.websocket_manager import WSManager  # type: ignore
-from discord import Message, RawReactionActionEvent, TextChannel
+from compact_storage import CompactWordTable
+from dataset_loader import LazyDataset, load_json_file, load_json_files
+from discord import (
+    HTTPException,
+    Message,
+    NotFound,
+    Object,
+    PartialMessage,
+    RawReactionActionEvent,
+    TextChannel,
+)
 from discord.ext import commands
+from fuzzy_index import FuzzyIndex, TableWords, WordList, WordSource
+from history import APPROVED, AUTO_REJECTED, REJECTED, DecisionHistory
+from membership_filter import FilterCache
+from normalization import NormalizedIndex, Normalizer
+from pending_requests import PendingRequest, PendingRequests
+from persistence import FlushScheduler, Journal, JournalEntry, write_json_atomic
+from snapshot import (
+    DATASET_TAGS,
+    SNAPSHOT_DATASET_KEYS,
+    MappedSnapshot,
+    TaggedDatasetView,
+    TaggedWordTable,
+    build_snapshot_from_json,
+    source_files,
+    source_fingerprint,
+)
+from snapshot_stream import SnapshotBlob, SnapshotCache
 from utils import BotClass, do_log
+from whitelist_index import WhitelistIndex
 
 
 class EmojiAction(str, Enum):
@@ -35,34 +80,82 @@ class WhitelistDatasets(TypedDict):
     - `trusted_usernames` is a set of all not-banned users who interacted with the project before this
     whitelist system was implemented.
     - `usernames` is used for allowing twitch usernames or mentions of ingame usernames. Appended to during operation.
+
+    With `binary_snapshot` or `compact_datasets` enabled, the large read-only datasets are views over a memory-mapped
+    snapshot or a compact in-memory word table rather than sets.
     """
 
     blacklist: Set[str]
     custom: Set[str]
-    custom_old: Set[str]
-    dictionary: Set[str]
+    custom_old: AbstractSet[str]
+    dictionary: AbstractSet[str]
     nicknames: Dict[str, str]
     nicknames_set: Set[str]
     random_prefixes: Set[str]
     random_suffixes: Set[str]
-    sorted_datasets: Set[str]
-    trusted_usernames: Set[str]
+    sorted_datasets: AbstractSet[str]
+    trusted_usernames: AbstractSet[str]
     usernames: Set[str]
     version: int
 
 
+BULK_COMMANDS = ["!approveall", "!rejectall", "!approve", "!reject"]
+REQUEST_COMMANDS = {"!whitelist": False, "!userwhitelist": True}
+
+
+def parse_request_command(content: str) -> Optional[Tuple[str, bool]]:
+    """
+    Returns the word and whether it's a username for a `!whitelist word` or `!userwhitelist word` message, or None
+    for anything else.
+    """
+    command, _, word = content.partition(" ")
+    if command not in REQUEST_COMMANDS or not word:
+        return None
+    return word, REQUEST_COMMANDS[command]
+
+
+# Datasets that a word may appear in to be considered whitelisted
+WHITELIST_DATASET_KEYS = [
+    "dictionary",
+    "custom",
+    "custom_old",
+    "sorted_datasets",
+    "usernames",
+    "nicknames_set",
+    "trusted_usernames",
+]
+
+
+def fuzzy_sources(datasets: List[Iterable[str]]) -> List[WordSource]:
+    """
+    Datasets in a tagged table share a single source, indexed by their position in it. Anything else is listed.
+    """
+    sources: List[WordSource] = []
+    table_words: Dict[int, TableWords] = {}
+    for dataset in datasets:
+        if isinstance(dataset, TaggedDatasetView):
+            table_source = table_words.get(id(dataset.table))
+            if table_source is None:
+                table_source = TableWords(dataset.table, 0)
+                table_words[id(dataset.table)] = table_source
+                sources.append(table_source)
+            table_source.tag |= dataset.tag
+        else:
+            sources.append(WordList(dataset))
+    return sources
+
+
 class WhitelistCog(commands.Cog):
     def __init__(self, bot: BotClass):
         self.bot = bot
-        self.user_whitelist_channel = self.bot.channels["username-request"]
-        self.word_whitelist_channel = self.bot.channels["whitelist-request"]
-        self.rejected_channel = self.bot.channels["whitelist-rejected"]
-        self.approved_channel = self.bot.channels["whitelist-approved"]
-
-        self.valid_react_channel_ids = {
-            self.user_whitelist_channel.id,
-            self.word_whitelist_channel.id,
-        }
+        # Channels are bound once Discord is ready, see `bind_channels`
+        self.user_whitelist_channel: TextChannel
+        self.word_whitelist_channel: TextChannel
+        self.rejected_channel: TextChannel
+        self.approved_channel: TextChannel
+        self.valid_react_channel_ids: Set[int] = set()
+        # Requests to the same channel are posted one at a time so their messages don't interleave
+        self.channel_locks: Dict[int, asyncio.Lock] = {}
         self.data_path_cfg: List[str] = self.bot.CFG.get("data_path", ["..", "data"])
         self.data_path = Path(*self.data_path_cfg)
         self.paths = {
@@ -76,6 +169,11 @@ class WhitelistCog(commands.Cog):
             "trusted_usernames": self.data_path / "trusted_usernames.json",
             "usernames": self.data_path / "usernames.json",
             "version": self.data_path / "version.json",
+            "changelog": self.data_path / "changelog.jsonl",
+            "history": self.data_path / "history.sqlite3",
+            "journal": self.data_path / "journal.jsonl",
+            "pending_requests": self.data_path / "pending_requests.json",
+            "snapshot": self.data_path / "snapshot.bin",
             "sorted_datasets": self.data_path / "sorted_datasets",
         }
 
@@ -93,13 +191,93 @@ class WhitelistCog(commands.Cog):
         ]
 
         self.init_files_if_missing()
+        self.journal = Journal(self.paths["journal"])
+        self.snapshot: Optional[TaggedWordTable] = None
+        self.normalizer = self.build_normalizer()
         self.datasets = self.load_data()
+        self.index = self.build_index()
+        self.blacklist_auto_reject: bool = self.bot.CFG.get(
+            "blacklist_auto_reject", True
+        )
+        self.blacklist_scanner = self.build_blacklist_scanner()
+        self.normalize: Callable[[str], str] = (
+            self.index.normalized.normalizer
+            if self.index.normalized is not None
+            else str.lower
+        )
+        self.pending_requests = PendingRequests(
+            self.normalize,
+            self.bot.CFG.get("pending_requests_max", 5000),
+            self.pending_requests_changed,
+        )
+        if self.paths["pending_requests"].exists():
+            self.pending_requests.load(load_json_file(self.paths["pending_requests"]))
+        self.history = DecisionHistory(self.paths["history"], self.normalize)
+        # Words rejected within this window are rejected again without reaching Discord, 0 turns it off
+        self.history_reject_window: float = (
+            self.bot.CFG.get("history_reject_window_days", 30) * 86400
+        )
+        self.fuzzy_index = FuzzyIndex(self.bot.CFG.get("fuzzy_max_distance", 2))
+        self.fuzzy_suggestions: int = self.bot.CFG.get("fuzzy_suggestions", 3)
+        # Built in the background, requests simply go without suggestions until it's ready
+        self.fuzzy_index_task = asyncio.create_task(self.build_fuzzy_index())
+        self.changelog = Changelog(
+            self.paths["changelog"],
+            self.datasets["version"],
+            self.bot.CFG.get("changelog_max_entries", 10000),
+        )
+
+        self.snapshot_cache = SnapshotCache(
+            self.collect_snapshot, self.bot.CFG.get("snapshot_chunk_size", 262144)
+        )
+
+        self.filter_cache = FilterCache(
+            self.collect_filter_words,
+            self.additions_since,
+            self.bot.CFG.get("filter_rebuild_threshold", 1000),
+        )
+
+        self.flush_scheduler = FlushScheduler(
+            self.flush_datasets, self.bot.CFG.get("flush_interval_ms", 5000)
+        )
+        if self.journal.entry_count > 0 or self.journal.sealed_path.exists():
+            # Fold anything left over from the last run into the snapshots
+            self.flush_scheduler.mark_dirty("custom")
+            self.flush_scheduler.mark_dirty("usernames")
         # self.version_data_path = Path(
         #     self.bot.CFG.get("version_data_path", ["..", "version_data"])
         # )
         # self.version = self.load_version()
 
+    def bind_channels(self):
+        self.user_whitelist_channel = self.bot.channels["username-request"]
+        self.word_whitelist_channel = self.bot.channels["whitelist-request"]
+        self.rejected_channel = self.bot.channels["whitelist-rejected"]
+        self.approved_channel = self.bot.channels["whitelist-approved"]
+
+        self.valid_react_channel_ids = {
+            self.user_whitelist_channel.id,
+            self.word_whitelist_channel.id,
+        }
+
     async def request_whitelist(self, data: Dict):
+        """
+        Posts a whitelist request to the respective channel, waiting for Discord first if it isn't ready. Words
+        reserved by `triage_request` that don't end up posted are released however this ends, so they can be
+        requested again.
+        """
+        try:
+            await self.post_whitelist_request(data)
+        finally:
+            is_username_req = data.get("is_username_req", False)
+            for word in data.get("requests", []):
+                self.pending_requests.release_reserved(word, is_username_req)
+
+    async def post_whitelist_request(self, data: Dict):
+        if not self.bot.ready:
+            do_log("[Discord not ready, holding whitelist request]")
+            await self.bot.ready_event.wait()
+
         requests = data.get("requests", [])
         message = data.get("message", "")
         username = data.get("username", "")
@@ -110,14 +288,70 @@ class WhitelistCog(commands.Cog):
             f"https://twitch.tv/popout/{channel_name}/viewercard/{username.lower()}"
         )
         command = "!userwhitelist" if is_username_req else "!whitelist"
-        whitelist_text = [f"{command} {word}" for word in requests]
+
+        if not requests:
+            return
+
+        # Scan the requested words and the chat message in a single pass. Exact matches never reach moderators, partial
+        # matches are flagged on the post.
+        *word_hits, message_hits = self.blacklist_scanner.scan_texts(
+            requests + [message]
+        )
+        accepted_requests: List[str] = []
+        rejected_requests: List[str] = []
+        flagged_lines: List[str] = []
+        for word, hits in zip(requests, word_hits):
+            if self.blacklist_auto_reject and word.lower() in hits:
+                rejected_requests.append(word)
+                continue
+            accepted_requests.append(word)
+            if hits:
+                flagged_lines.append(f"`{word}` ({', '.join(sorted(hits))})")
+        if message_hits:
+            flagged_lines.append(f"message ({', '.join(sorted(message_hits))})")
+
+        suggestion_lines: List[str] = []
+        if self.fuzzy_index.ready and not is_username_req:
+            for word in accepted_requests:
+                suggestions = self.fuzzy_index.lookup(
+                    word.lower(), self.fuzzy_suggestions
+                )
+                if suggestions:
+                    suggestion_lines.append(f"`{word}` → {', '.join(suggestions)}")
+
+        if rejected_requests:
+            do_log(f"[Auto-rejected blacklisted requests: {rejected_requests}]")
+            for word in rejected_requests:
+                self.pending_requests.release(word, is_username_req)
+            await self.history.record_decisions(
+                rejected_requests, is_username_req, AUTO_REJECTED, "blacklist"
+            )
+            rejected_text = "\n".join(f"{command} {word}" for word in rejected_requests)
+            await self.rejected_channel.send(
+                f"__Auto-rejected (blacklisted) from {username}__\n{rejected_text}"
+            )
+        if not accepted_requests:
+            return
+
+        whitelist_text = [f"{command} {word}" for word in accepted_requests]
         message_title = (
             f"__Username Request__\n**{username}**"
             if is_username_req
             else f"__Whitelist Request from {username}__"
         )
+        flagged_text = (
+            f":warning: **Blacklist hits:** {', '.join(flagged_lines)}\n"
+            if flagged_lines
+            else ""
+        )
+        suggestion_text = (
+            f":mag: **Did you mean:** {'; '.join(suggestion_lines)}\n"
+            if suggestion_lines
+            else ""
+        )
         header_content = (
-            f"** **\n** **\n{message_title}\n```{message}```\n<{user_url}>\n"
+            f"** **\n** **\n{message_title}\n```{message}```\n{flagged_text}{suggestion_text}"
+            f"<{user_url}>\n"
             f"<https://twitch.tv/{channel_name}>\n** **"
         )
 
@@ -127,10 +361,16 @@ class WhitelistCog(commands.Cog):
             else self.word_whitelist_channel
         )
 
-        await channel.send(header_content)
+        channel_lock = self.channel_locks.setdefault(channel.id, asyncio.Lock())
         messages_to_react: List[Message] = []
-        for request in whitelist_text:
-            messages_to_react.append(await channel.send(request))
+        async with channel_lock:
+            await channel.send(header_content)
+            for word, request in zip(accepted_requests, whitelist_text):
+                request_message = await channel.send(request)
+                self.pending_requests.bind(
+                    word, is_username_req, request_message.id, channel.id
+                )
+                messages_to_react.append(request_message)
 
         set_emoji_key = (
             EmojiAction.SET_WORD if is_username_req else EmojiAction.SET_USERNAME
@@ -142,8 +382,70 @@ class WhitelistCog(commands.Cog):
                 await message.add_reaction(self.react_emojis[react_emoji])
                 await async_sleep(0.1)
 
+    async def triage_request(self, data: Dict) -> Dict:
+        """
+        Sorts the words of an incoming request before it's queued. Words already whitelisted under some normalized
+        form are answered straight away, as are words a moderator rejected recently. Words already awaiting a
+        decision are attached to that request, and only the rest are reserved as pending and left in `requests` to
+        be posted.
+        """
+        username = data.get("username", "")
+        is_username_req = data.get("is_username_req", False)
+        # Requested words are misses by definition, so they're checked against the lazy datasets too
+        await self.index.load_lazy()
+
+        new_requests: List[str] = []
+        whitelisted: Dict[str, str] = {}
+        rejected: Dict[str, float] = {}
+        pending: List[str] = []
+        now = time()
+        for word in data.get("requests", []):
+            match = self.index.match(word)
+            if match is not None:
+                whitelisted[word] = match
+                continue
+            decision = self.history.last_decision(word, is_username_req)
+            if (
+                decision is not None
+                and decision["decision"] == REJECTED
+                and now - decision["decided_at"] < self.history_reject_window
+            ):
+                rejected[word] = decision["decided_at"]
+                continue
+            pending_request = self.pending_requests.get(word, is_username_req)
+            if pending_request is not None:
+                pending_request.requesters.append(username)
+                pending.append(word)
+                if pending_request.message_id is not None:
+                    self.pending_requests_changed()
+                continue
+            self.pending_requests.reserve(word, is_username_req, username)
+            new_requests.append(word)
+
+        await self.history.record_requests(
+            data.get("requests", []), is_username_req, username
+        )
+        if rejected:
+            await self.history.record_decisions(
+                list(rejected), is_username_req, AUTO_REJECTED, "history"
+            )
+
+        if whitelisted or rejected or pending:
+            do_log(
+                f"[Coalesced request from {username}: {len(whitelisted)} already whitelisted, "
+                f"{len(rejected)} previously rejected, {len(pending)} already pending "
+                f"({len(self.pending_requests)} pending total)]"
+            )
+        return {
+            "requests": new_requests,
+            "whitelisted": whitelisted,
+            "rejected": rejected,
+            "pending": pending,
+        }
+
     def init_files_if_missing(self):
         self.data_path.mkdir(parents=True, exist_ok=True)
+        self.paths["sorted_datasets"].mkdir(exist_ok=True)
         # { file_path_key: default_value }
         default_data = {
             "blacklist": [],
@@ -176,103 +478,437 @@ class WhitelistCog(commands.Cog):
             "usernames",
         ]
         datasets: Dict[str, Set[str]] = {}
+        read_only_datasets: Dict[str, AbstractSet[str]] = {}
 
-        # Load and set all files
-        for dataset_type in base_dataset_paths:
-            dataset_path = self.paths[dataset_type]
-            try:
-                with open(dataset_path, "r") as f:
-                    data = json.load(f)
-                    datasets[dataset_type] = set(data)
-                    do_log(f"Loaded {dataset_path.as_posix()}")
-            except Exception:
-                raise ValueError(f"{dataset_path} malformed or missing")
+        # Large, read-only datasets can be served straight from a memory-mapped snapshot instead
+        snapshot_keys: List[str] = []
+        if self.bot.CFG.get("binary_snapshot", False):
+            snapshot_keys = SNAPSHOT_DATASET_KEYS
+            self.snapshot = self.load_snapshot()
+            for dataset_type in snapshot_keys:
+                read_only_datasets[dataset_type] = TaggedDatasetView(
+                    self.snapshot, dataset_type
+                )
 
-        # Assemble all files in `sorted_datasets` folder to a single dataset
+        # Otherwise they can be packed into a compact in-memory word table once loaded
+        compact_keys: List[str] = []
+        if self.bot.CFG.get("compact_datasets", False):
+            compact_keys = [
+                dataset_type
+                for dataset_type in SNAPSHOT_DATASET_KEYS
+                if dataset_type not in snapshot_keys
+            ]
 
-        datasets["sorted_datasets"] = set()
-        for dataset_file in self.paths["sorted_datasets"].glob("*.json"):
-            try:
-                with open(dataset_file, "r") as f:
-                    data = json.load(f)
-                    datasets["sorted_datasets"].update(set(data))
-                    do_log(f"Loaded {dataset_file.as_posix()}")
-            except Exception:
-                raise ValueError(f"{dataset_file} malformed or missing")
-
-        # Load nicknames and split key-values to a set
-        try:
-            with open(self.paths["nicknames"], "r") as f:
-                nicknames = json.load(f)
-                datasets["nicknames_set"] = set(nicknames.keys()).union(
-                    set(nicknames.values())
+        # Rarely needed, read-only datasets are left on disk until first accessed
+        lazy_keys: List[str] = [
+            dataset_type
+            for dataset_type in self.bot.CFG.get(
+                "lazy_datasets", ["custom_old", "trusted_usernames"]
+            )
+            if dataset_type in SNAPSHOT_DATASET_KEYS
+            and dataset_type not in snapshot_keys
+            and dataset_type not in compact_keys
+        ]
+        for dataset_type, paths in source_files(self.paths, lazy_keys).items():
+            read_only_datasets[dataset_type] = LazyDataset(dataset_type, paths)
+
+        # Parse everything else up front. Every file in `sorted_datasets` is assembled to a single dataset.
+        start_time = perf_counter()
+        eager_keys = [
+            dataset_type
+            for dataset_type in base_dataset_paths + ["sorted_datasets"]
+            if dataset_type not in read_only_datasets
+        ]
+        sources = source_files(self.paths, eager_keys + ["nicknames", "version"])
+        loaded = load_json_files(sources)
+        for dataset_type in eager_keys:
+            if dataset_type not in compact_keys:
+                datasets[dataset_type] = set().union(*loaded[dataset_type])
+
+        if compact_keys:
+            table_start_time = perf_counter()
+            table = CompactWordTable(
+                {
+                    dataset_type: chain.from_iterable(loaded[dataset_type])
+                    for dataset_type in compact_keys
+                },
+                self.normalizer,
+            )
+            self.snapshot = table
+            for dataset_type in compact_keys:
+                read_only_datasets[dataset_type] = TaggedDatasetView(
+                    table, dataset_type
                 )
-                do_log(f"Loaded {self.paths['nicknames'].as_posix()}")
-        except Exception:
-            raise ValueError(f"{self.paths['nicknames']} malformed or missing")
+            do_log(
+                f"Built compact word table ({table.count} words, {table.nbytes / 1024 / 1024:.1f}MiB, "
+                f"{(perf_counter() - table_start_time) * 1000:.0f}ms)"
+            )
+
+        # Split nickname key-values to a set
+        nicknames: Dict[str, str] = loaded["nicknames"][0]
+        datasets["nicknames_set"] = set(nicknames.keys()).union(set(nicknames.values()))
 
-        # Load version and parse
         try:
-            with open(self.paths["version"], "r") as f:
-                data = json.load(f)
-                version = int(data["version"])
-                do_log(f"Loaded {self.paths['version'].as_posix()}")
+            version = int(loaded["version"][0]["version"])
         except Exception:
             raise ValueError(f"{self.paths['version']} malformed or missing")
+        do_log(f"Loaded datasets in {(perf_counter() - start_time) * 1000:.0f}ms")
+
+        # Replay approvals journaled since the last compaction
+        for entry in self.journal.replay():
+            dataset_index = "usernames" if entry["is_username"] else "custom"
+            datasets[dataset_index].add(entry["word"])
+            version = max(version, entry["version"])
+        do_log(f"Replayed {self.journal.entry_count} journal entries (-> v{version})")
+
+        for dataset_type in SNAPSHOT_DATASET_KEYS:
+            if dataset_type not in read_only_datasets:
+                read_only_datasets[dataset_type] = datasets.pop(dataset_type)
 
         return WhitelistDatasets(
             blacklist=datasets.pop("blacklist"),
             custom=datasets.pop("custom"),
-            custom_old=datasets.pop("custom_old"),
-            dictionary=datasets.pop("dictionary"),
+            custom_old=read_only_datasets.pop("custom_old"),
+            dictionary=read_only_datasets.pop("dictionary"),
             nicknames=nicknames,
             nicknames_set=datasets.pop("nicknames_set"),
             random_prefixes=datasets.pop("random_prefixes"),
             random_suffixes=datasets.pop("random_suffixes"),
-            sorted_datasets=datasets.pop("sorted_datasets"),
-            trusted_usernames=datasets.pop("trusted_usernames"),
+            sorted_datasets=read_only_datasets.pop("sorted_datasets"),
+            trusted_usernames=read_only_datasets.pop("trusted_usernames"),
             usernames=datasets.pop("usernames"),
             version=version,
         )
 
-    async def add_and_save(self, word: str, is_username: bool):
+    def build_index(self) -> WhitelistIndex:
+        snapshot_keys = [
+            key
+            for key in WHITELIST_DATASET_KEYS
+            if isinstance(self.datasets[key], TaggedDatasetView)  # type: ignore
+        ]
+        lazy_keys = [
+            key
+            for key in WHITELIST_DATASET_KEYS
+            if isinstance(self.datasets[key], LazyDataset)  # type: ignore
+        ]
+        index = WhitelistIndex(
+            (
+                self.datasets[key]  # type: ignore
+                for key in WHITELIST_DATASET_KEYS
+                if key not in snapshot_keys and key not in lazy_keys
+            ),
+            self.snapshot,
+            sum(DATASET_TAGS[key] for key in snapshot_keys),
+            [self.datasets[key] for key in lazy_keys],  # type: ignore
+            NormalizedIndex(self.normalizer) if self.normalizer is not None else None,
+        )
+        do_log(
+            f"Built whitelist index ({len(index)} words, {index.build_time * 1000:.0f}ms)"
+        )
+        if index.normalized is not None:
+            do_log(
+                f"Built normalized index ({len(index.normalized)} forms, "
+                f"{index.normalized.build_time * 1000:.0f}ms)"
+            )
+        return index
+
+    def build_normalizer(self) -> Optional[Normalizer]:
+        steps: Optional[List[str]] = self.bot.CFG.get("normalization_steps")
+        if steps == []:
+            return None
+        return Normalizer(steps, self.bot.CFG.get("leet_map"))
+
+    async def build_fuzzy_index(self):
+        dataset_keys: List[str] = self.bot.CFG.get(
+            "fuzzy_datasets", ["dictionary", "custom_old", "custom"]
+        )
+        # Sets are copied here, anything added after that goes to `additions`. Read-only datasets are passed as they
+        # are, so lazy ones are loaded on the worker thread rather than here.
+        datasets: List[Iterable[str]] = []
+        for key in dataset_keys:
+            dataset = self.datasets[key]  # type: ignore
+            datasets.append(list(dataset) if isinstance(dataset, set) else dataset)
+        await asyncio.to_thread(lambda: self.fuzzy_index.build(fuzzy_sources(datasets)))
+
+    def build_blacklist_scanner(self) -> BlacklistScanner:
+        start_time = perf_counter()
+        scanner = BlacklistScanner(self.datasets["blacklist"])
+        do_log(
+            f"Built blacklist scanner ({len(self.datasets['blacklist'])} patterns, "
+            f"{(perf_counter() - start_time) * 1000:.0f}ms)"
+        )
+        return scanner
+
+    def reload_blacklist(self):
         """
-        Adds a word to the whitelist, and increments the version. Saves both changes to respective files.
+        Re-reads the blacklist from disk and rebuilds the scanner from it.
         """
-        dataset_index = "usernames" if is_username else "custom"
-        self.datasets[dataset_index].add(word)  # type: ignore
-        self.datasets["version"] += 1
+        self.datasets["blacklist"] = set(load_json_file(self.paths["blacklist"]))
+        self.blacklist_scanner = self.build_blacklist_scanner()
 
-        async with aiofiles.open(self.paths["version"], "w") as f:
-            await f.write(json.dumps({"version": self.datasets["version"]}))
+    def check_text(self, data: Dict) -> Dict:
+        """
+        Checks a single message (`text`) or a batch of messages (`texts`) against the whitelist index.
+        """
+        texts: List[str] = data.get("texts", [])
+        if "text" in data:
+            texts = [data["text"]]
 
-        async with aiofiles.open(self.paths[dataset_index], "w") as f:
-            await f.write(json.dumps(sorted(list(self.datasets[dataset_index])), indent=2))  # type: ignore
+        words_before = self.index.words_checked
+        time_before = self.index.check_time
+        results = self.index.check_texts(texts)
 
-        do_log(
-            f"[Saved {word} to {dataset_index} dataset (-> v{self.datasets['version']}).]"
+        words_checked = self.index.words_checked - words_before
+        check_time = self.index.check_time - time_before
+        if check_time > 0:
+            do_log(
+                f"[Checked {words_checked} words in {check_time * 1000:.2f}ms "
+                f"({words_checked / check_time:.0f} words/s)]"
+            )
+        return {"version": self.datasets["version"], "results": results}
+
+    def sync_since(self, data: Dict) -> Optional[Dict]:
+        """
+        Returns every addition made after the client's `version`, or None if the changelog no longer reaches back
+        that far and the client needs a full snapshot instead.
+        """
+        version = int(data.get("version", 0))
+        entries = self.changelog.since(version)
+        if entries is None:
+            return None
+        return {
+            "from_version": version,
+            "to_version": self.datasets["version"],
+            "additions": [
+                {"word": entry["word"], "is_username": entry["is_username"]}
+                for entry in entries
+            ],
+        }
+
+    def load_snapshot(self) -> MappedSnapshot:
+        """
+        Maps the binary snapshot of the read-only datasets, rebuilding it first if the JSON sources or the
+        normalization config have changed.
+        """
+        sources = source_files(self.paths, SNAPSHOT_DATASET_KEYS)
+        fingerprint = source_fingerprint(sources)
+        form_fingerprint = (
+            self.normalizer.fingerprint if self.normalizer is not None else 0
         )
+        snapshot_path = self.paths["snapshot"]
+
+        snapshot: Optional[MappedSnapshot] = None
+        if snapshot_path.exists():
+            try:
+                snapshot = MappedSnapshot(snapshot_path)
+            except ValueError:
+                do_log(f"[{snapshot_path.as_posix()} unreadable, rebuilding]")
+        if (
+            snapshot is None
+            or snapshot.fingerprint != fingerprint
+            or snapshot.form_fingerprint != form_fingerprint
+        ):
+            build_snapshot_from_json(sources, snapshot_path, normalizer=self.normalizer)
+            snapshot = MappedSnapshot(snapshot_path)
+
+        do_log(f"Loaded {snapshot_path.as_posix()} ({snapshot.count} words)")
+        return snapshot
+
+    def collect_snapshot(self) -> Tuple[int, Dict[str, Any]]:
+        """
+        Gathers every dataset for `GET_SNAPSHOT`, copying those that change during operation. Read-only snapshot
+        views and lazy datasets are passed as they are, and only read on the worker thread.
+        """
+        datasets: Dict[str, Any] = {}
+        for dataset_key, dataset in self.datasets.items():
+            if dataset_key == "version":
+                continue
+            if isinstance(dataset, dict):
+                datasets[dataset_key] = dict(dataset)
+            elif isinstance(dataset, set):
+                datasets[dataset_key] = list(dataset)
+            else:
+                datasets[dataset_key] = dataset
+        return self.datasets["version"], datasets
+
+    async def get_snapshot(self) -> SnapshotBlob:
+        return await self.snapshot_cache.get(self.datasets["version"])
+
+    def collect_filter_words(self) -> Tuple[int, List[Iterable[str]]]:
+        """
+        Gathers every whitelist dataset for the membership filter, copying those that change during operation.
+        """
+        datasets: List[Iterable[str]] = []
+        for key in WHITELIST_DATASET_KEYS:
+            dataset = self.datasets[key]  # type: ignore
+            datasets.append(list(dataset) if isinstance(dataset, set) else dataset)
+        return self.datasets["version"], datasets
+
+    def additions_since(self, version: int) -> Optional[List[str]]:
+        entries = self.changelog.since(version)
+        if entries is None:
+            return None
+        return [entry["word"] for entry in entries]
+
+    async def get_filter(self) -> Tuple[bytes, Dict]:
+        """
+        Returns the serialized membership filter, and its metadata along with the exact list of words added since
+        it was built.
+        """
+        artifact, additions = await self.filter_cache.get()
+        return artifact.data, {
+            **artifact.metadata(),
+            "exceptions": additions,
+            "exceptions_version": self.datasets["version"],
+        }
+
+    async def add_and_save(self, word: str, is_username: bool) -> int:
+        """
+        Adds a word to the whitelist, and increments the version, returning the version it produced. The change is
+        journaled immediately, and folded into the respective files on the next scheduled flush.
+        """
+        _, version = await self.add_many_and_save([(word, is_username)])
+        return version
+
+    async def add_many_and_save(
+        self, additions: List[Tuple[str, bool]]
+    ) -> Tuple[int, int]:
+        """
+        Adds every `(word, is_username)` pair to the whitelist, each getting its own version, then journals them
+        with a single write. Returns the versions before and after, read before anything else can add to them.
+        """
+        from_version = self.datasets["version"]
+        entries: List[JournalEntry] = []
+        for word, is_username in additions:
+            dataset_index = "usernames" if is_username else "custom"
+            self.datasets[dataset_index].add(word)  # type: ignore
+            self.index.add(word)
+            self.pending_requests.release(word, is_username)
+            if not is_username:
+                self.fuzzy_index.add(word)
+            self.datasets["version"] += 1
+            entries.append(
+                JournalEntry(
+                    version=self.datasets["version"], word=word, is_username=is_username
+                )
+            )
+            self.flush_scheduler.mark_dirty(dataset_index)
+        to_version = self.datasets["version"]
+        # Recorded before any await, so concurrent additions can't land in the changelog out of version order
+        self.changelog.record_many(entries)  # type: ignore
+
+        await self.journal.append_many(entries)
+        await self.changelog.write()
+        self.filter_cache.on_addition()
+
+        if len(entries) == 1:
+            do_log(
+                f"[Saved {entries[0]['word']} to "
+                f"{'usernames' if entries[0]['is_username'] else 'custom'} dataset (-> v{to_version}).]"
+            )
+        else:
+            do_log(f"[Saved {len(entries)} words (-> v{to_version}).]")
+        return from_version, to_version
+
+    async def flush_datasets(self, dataset_indexes: Set[str]):
+        """
+        Writes the dirty datasets and version out as sorted JSON snapshots, then drops the journal entries they
+        cover. Serializing happens off the event loop.
+        """
+        write_pending = "pending_requests" in dataset_indexes
+        dataset_indexes = dataset_indexes - {"pending_requests"}
+
+        # Seal and copy before any await, so anything journaled meanwhile stays in the live segment
+        if dataset_indexes:
+            self.journal.seal()
+            snapshots = {
+                dataset_index: list(self.datasets[dataset_index])  # type: ignore
+                for dataset_index in dataset_indexes
+            }
+            version = self.datasets["version"]
+            await asyncio.to_thread(self.write_snapshots, snapshots, version)
+            self.journal.discard_sealed()
+            do_log(f"[Flushed {', '.join(sorted(dataset_indexes))} (v{version}).]")
+
+        if write_pending:
+            await asyncio.to_thread(
+                write_json_atomic,
+                self.paths["pending_requests"],
+                self.pending_requests.to_json(),
+            )
+
+    async def shutdown(self):
+        await self.flush_scheduler.shutdown()
+        self.journal.close()
+        self.history.close()
+
+    def write_snapshots(self, snapshots: Dict[str, List[str]], version: int):
+        for dataset_index, words in snapshots.items():
+            write_json_atomic(self.paths[dataset_index], sorted(words), indent=2)
+        write_json_atomic(self.paths["version"], {"version": version})
 
-    async def move_request(self, message: Message, channel: TextChannel):
+    async def move_request(
+        self,
+        message: Union[Message, PartialMessage],
+        channel: TextChannel,
+        request: Optional[PendingRequest] = None,
+        moderator: str = "",
+        is_username: Optional[bool] = None,
+    ):
         """
         Copies a message with the author and source channel as a header to the specified channel,
-        deleting it afterwards.
+        deleting it afterwards. With the message's cached 'request', the copy is made without fetching it.
+        The move is recorded as a decision by 'moderator', for 'is_username' if the word was approved as a different
+        type than it was requested as.
         """
+        if request is not None:
+            author_name = self.bot.client.user.display_name
+            content = request.command
+        else:
+            message = cast(Message, message)
+            author_name = message.author.display_name
+            content = message.content
+
+        # Stray messages and request headers are moved too, but only requests are decisions
+        parsed = parse_request_command(content)
+        if parsed is not None:
+            word, requested_as_username = parsed
+            await self.history.record_decisions(
+                [word],
+                requested_as_username if is_username is None else is_username,
+                APPROVED if channel == self.approved_channel else REJECTED,
+                moderator,
+            )
         await channel.send(
-            f"__({cast(TextChannel, message.channel).mention}) {message.author.display_name}__\n{message.content}"
+            f"__({cast(TextChannel, message.channel).mention}) {author_name}__\n{content}"
         )
         await message.delete()
+        self.pending_requests.pop_message(message.id)
+
+    def pending_requests_changed(self):
+        self.flush_scheduler.mark_dirty("pending_requests")
 
-    async def approve_request(self, message: Message, is_username: bool):
-        # HACK: Assumes the message is fmted like `!whitelist wordhere` or `!userwhitelist wordhere`
-        word = message.content.split(" ", 1)[-1]
+    async def approve_request(
+        self,
+        message: Union[Message, PartialMessage],
+        is_username: bool,
+        request: Optional[PendingRequest] = None,
+        moderator: str = "",
+    ):
+        if request is not None:
+            word = request.word
+        else:
+            # HACK: Assumes the message is fmted like `!whitelist wordhere` or `!userwhitelist wordhere`
+            word = cast(Message, message).content.split(" ", 1)[-1]
 
-        await self.add_and_save(word, is_username)
+        version = await self.add_and_save(word, is_username)
         active_ws_manager: WSManager = self.bot.client.get_cog(
             "WebsocketManagerCog"
         ).ws_manager
-        await active_ws_manager.broadcast_update(word, is_username)
-        await self.move_request(message, self.approved_channel)
+        await active_ws_manager.broadcast_update(word, is_username, version)
+        await self.move_request(
+            message, self.approved_channel, request, moderator, is_username
+        )
 
     @commands.Cog.listener("on_message")
     async def manual_commands(self, message: Message):
@@ -281,10 +917,167 @@ class WhitelistCog(commands.Cog):
         if message.guild is None or message.guild.id != self.bot.guild.id:
             return
 
+        moderator = message.author.display_name
         if message.content.startswith("!whitelist "):
-            await self.approve_request(message, is_username=False)
+            await self.approve_request(message, False, moderator=moderator)
         elif message.content.startswith("!userwhitelist "):
-            await self.approve_request(message, is_username=True)
+            await self.approve_request(message, True, moderator=moderator)
+        elif message.content.startswith("!history "):
+            await self.history_command(message)
+        elif message.content.split(" ", 1)[0] in BULK_COMMANDS:
+            await self.bulk_command(message)
+        elif message.content == "!reloadblacklist":
+            self.reload_blacklist()
+            await message.channel.send(
+                f"Reloaded blacklist ({len(self.datasets['blacklist'])} patterns)"
+            )
+
+    async def history_command(self, message: Message):
+        """
+        `!history <word>` shows past decisions on a word, `!history user <name>` shows what someone requested.
+        """
+        args = message.content.split()[1:]
+        if len(args) == 2 and args[0] == "user":
+            rows = self.history.requests_by(args[1])
+            lines = [
+                f"`{word}` <t:{int(requested_at)}:R>" for word, requested_at in rows
+            ]
+            summary = f"__Requests by {args[1]}__\n" + ("\n".join(lines) or "None")
+        else:
+            word = " ".join(args)
+            request_count, requester_count = self.history.request_stats(word)
+            lines = [
+                f"{decision['decision']} `{decision['word']}` by {decision['moderator'] or 'unknown'} "
+                f"<t:{int(decision['decided_at'])}:R>"
+                for decision in self.history.decisions_for(word)
+            ]
+            summary = (
+                f"__History of {word}__ (requested {request_count} times by {requester_count} users)\n"
+                + ("\n".join(lines) or "No decisions")
+            )
+        await message.channel.send(summary[:2000])
+
+    async def bulk_command(self, message: Message):
+        """
+        `!approveall`/`!rejectall` resolve every pending request in the channel they're sent in, `!approve`/`!reject`
+        followed by message ids resolve just those.
+        """
+        command, *args = message.content.split()
+        approve = command in ("!approveall", "!approve")
+        channel = cast(TextChannel, message.channel)
+        if channel.id not in self.valid_react_channel_ids:
+            await channel.send(f"`{command}` only works in a request channel")
+            return
+
+        requests: List[PendingRequest]
+        if command in ("!approveall", "!rejectall"):
+            requests = [
+                request
+                for request in self.pending_requests.by_message.values()
+                if request.channel_id == channel.id
+            ]
+        else:
+            try:
+                message_ids = [int(arg) for arg in args]
+            except ValueError:
+                await channel.send(f"Usage: `{command} <message id> ...`")
+                return
+            requests = await self.resolve_requests(channel, message_ids)
+
+        if requests:
+            await self.bulk_resolve(
+                channel, requests, approve, message.author.display_name
+            )
+        await message.delete()
+
+    async def resolve_requests(
+        self, channel: TextChannel, message_ids: List[int]
+    ) -> List[PendingRequest]:
+        """
+        Looks up each message id in the pending request index, only fetching messages it doesn't know.
+        """
+        is_username = channel.id == self.user_whitelist_channel.id
+        requests: List[PendingRequest] = []
+        for message_id in message_ids:
+            request = self.pending_requests.by_message.get(message_id)
+            if request is None:
+                try:
+                    fetched = await channel.fetch_message(message_id)
+                except NotFound:
+                    continue
+                # HACK: Assumes the message is fmted like `!whitelist wordhere` or `!userwhitelist wordhere`
+                request = PendingRequest(
+                    fetched.content.split(" ", 1)[-1], is_username, ""
+                )
+                request.message_id = message_id
+                request.channel_id = channel.id
+            requests.append(request)
+        return requests
+
+    async def bulk_resolve(
+        self,
+        channel: TextChannel,
+        requests: List[PendingRequest],
+        approve: bool,
+        moderator: str = "",
+    ):
+        """
+        Approves or rejects a batch of requests from one channel. Every addition is saved in one go and broadcast as
+        one update, moved requests are summarized in as few messages as possible, and the originals are bulk deleted.
+        """
+        start_time = perf_counter()
+        is_username = channel.id == self.user_whitelist_channel.id
+        if approve:
+            additions = [(request.word, is_username) for request in requests]
+            from_version, to_version = await self.add_many_and_save(additions)
+            active_ws_manager: WSManager = self.bot.client.get_cog(
+                "WebsocketManagerCog"
+            ).ws_manager
+            await active_ws_manager.broadcast_updates(
+                additions, from_version, to_version
+            )
+
+        await self.history.record_decisions(
+            [request.word for request in requests],
+            is_username,
+            APPROVED if approve else REJECTED,
+            moderator,
+        )
+
+        # Discord caps messages at 2000 characters
+        target_channel = self.approved_channel if approve else self.rejected_channel
+        header = f"__({channel.mention}) {self.bot.client.user.display_name}__"
+        summary = header
+        for request in requests:
+            line = f"\n{request.command}"
+            if len(summary) + len(line) > 2000:
+                await target_channel.send(summary)
+                summary = header
+            summary += line
+        await target_channel.send(summary)
+
+        # Bulk deletes take up to 100 messages, and only those under two weeks old
+        message_ids = [cast(int, request.message_id) for request in requests]
+        for start in range(0, len(message_ids), 100):
+            batch = [
+                Object(message_id) for message_id in message_ids[start : start + 100]
+            ]
+            try:
+                await channel.delete_messages(batch)
+            except HTTPException:
+                for message_object in batch:
+                    try:
+                        await channel.get_partial_message(message_object.id).delete()
+                    except NotFound:
+                        pass
+        for request in requests:
+            self.pending_requests.pop_message(cast(int, request.message_id))
+
+        elapsed = perf_counter() - start_time
+        do_log(
+            f"[Bulk {'approved' if approve else 'rejected'} {len(requests)} requests in {elapsed * 1000:.0f}ms "
+            f"({len(requests) / elapsed:.0f}/s)]"
+        )
 
     @commands.Cog.listener("on_raw_reaction_add")
     async def whitelist_request_action(self, payload: RawReactionActionEvent):
@@ -322,14 +1115,27 @@ class WhitelistCog(commands.Cog):
                 f"Could not find channel ({payload.channel_id}) despite a detected reaction!"
             )
 
-        message = await channel.fetch_message(payload.message_id)
+        # Requests posted by `request_whitelist` are resolved from the index, anything else is fetched
+        message: Union[Message, PartialMessage]
+        request = self.pending_requests.by_message.get(payload.message_id)
+        if request is not None:
+            message = channel.get_partial_message(payload.message_id)
+        else:
+            message = await channel.fetch_message(payload.message_id)
 
+        moderator = (
+            payload.member.display_name
+            if payload.member is not None
+            else str(payload.user_id)
+        )
         match decision:
             case EmojiAction.REJECT:
-                await self.move_request(message, self.rejected_channel)
+                await self.move_request(
+                    message, self.rejected_channel, request, moderator
+                )
 
             case EmojiAction.SET_USERNAME:
-                await self.approve_request(message, is_username=True)
+                await self.approve_request(message, True, request, moderator)
 
             case EmojiAction.SET_WORD:
-                await self.approve_request(message, is_username=False)
+                await self.approve_request(message, False, request, moderator)
@@ -0,0 +1,209 @@
+import json
+import random
+import tracemalloc
+from argparse import ArgumentParser
+from array import array
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+from dataset_loader import load_json_files
+from normalization import Normalizer, form_entries
+from snapshot import DATASET_TAGS, SNAPSHOT_DATASET_KEYS, source_files
+from utils import do_log
+
+
+class CompactWordTable:
+    """
+    An in-memory counterpart to `MappedSnapshot`: every word of the given datasets stored once, tagged with the
+    datasets it belongs to. Words live UTF-8 encoded and sorted in a single bytes object, with offsets and tags in
+    typed arrays, so a word costs a few bytes rather than a whole `str` object plus a set slot per dataset. With a
+    'normalizer', the normalized forms are stored the same way while the words are still at hand.
+    """
+
+    def __init__(
+        self,
+        datasets: Mapping[str, Iterable[str]],
+        normalizer: Optional[Normalizer] = None,
+    ):
+        tags: Dict[str, int] = {}
+        for dataset_key, words in datasets.items():
+            tag = DATASET_TAGS[dataset_key]
+            for word in words:
+                tags[word] = tags.get(word, 0) | tag
+
+        encoded = sorted(
+            (word.encode("utf-8"), word, tag) for word, tag in tags.items()
+        )
+        self.count = len(encoded)
+        self.words = b"".join(word_bytes for word_bytes, _, _ in encoded)
+        self.offsets = array("I", [0])
+        self.tags = array("H")
+        self.tag_counts: Dict[int, int] = {}
+        for word_bytes, _, tag in encoded:
+            self.offsets.append(self.offsets[-1] + len(word_bytes))
+            self.tags.append(tag)
+            for dataset_tag in DATASET_TAGS.values():
+                if tag & dataset_tag:
+                    self.tag_counts[dataset_tag] = (
+                        self.tag_counts.get(dataset_tag, 0) + 1
+                    )
+
+        forms = (
+            form_entries((word for _, word, _ in encoded), normalizer)
+            if normalizer is not None
+            else []
+        )
+        self.form_fingerprint = normalizer.fingerprint if normalizer is not None else 0
+        self.form_count = len(forms)
+        self.forms = b"".join(form_bytes for form_bytes, _ in forms)
+        self.form_offsets = array("I", [0])
+        self.form_positions = array("I", (position for _, position in forms))
+        for form_bytes, _ in forms:
+            self.form_offsets.append(self.form_offsets[-1] + len(form_bytes))
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            len(self.words)
+            + self.offsets.itemsize * len(self.offsets)
+            + self.tags.itemsize * len(self.tags)
+            + len(self.forms)
+            + self.form_offsets.itemsize * len(self.form_offsets)
+            + self.form_positions.itemsize * len(self.form_positions)
+        )
+
+    def flags(self, word: str) -> int:
+        """
+        Returns the dataset tag bitmask for 'word', or 0 if it's in none of them.
+        """
+        key = word.encode("utf-8")
+        words, offsets = self.words, self.offsets
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            probe = words[offsets[middle] : offsets[middle + 1]]
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                return self.tags[middle]
+        return 0
+
+    def word_at(self, position: int) -> str:
+        return self.words[self.offsets[position] : self.offsets[position + 1]].decode(
+            "utf-8"
+        )
+
+    def lookup_form(self, form: str, tag: int) -> Optional[str]:
+        """
+        Returns the word tagged with 'tag' that normalizes to 'form', if the table was built with a normalizer.
+        """
+        key = form.encode("utf-8")
+        forms, offsets = self.forms, self.form_offsets
+        low, high = 0, self.form_count
+        while low < high:
+            middle = (low + high) // 2
+            probe = forms[offsets[middle] : offsets[middle + 1]]
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                position = self.form_positions[middle]
+                return self.word_at(position) if self.tags[position] & tag else None
+        return None
+
+    def iter_tagged_positions(self, tag: int) -> Iterator[Tuple[int, str]]:
+        words, offsets = self.words, self.offsets
+        for position, entry_tag in enumerate(self.tags):
+            if entry_tag & tag:
+                yield position, words[offsets[position] : offsets[position + 1]].decode(
+                    "utf-8"
+                )
+
+    def iter_tagged(self, tag: int) -> Iterator[str]:
+        return (word for _, word in self.iter_tagged_positions(tag))
+
+    def count_tagged(self, tag: int) -> int:
+        return self.tag_counts.get(tag, 0)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compares memory use and lookup latency of plain sets against the compact word table."
+    )
+    parser.add_argument(
+        "--config", help="Filepath for the config JSON file", default="config.json"
+    )
+    parser.add_argument(
+        "--lookups", help="Lookups to time per case", type=int, default=100000
+    )
+    args = parser.parse_args()
+    with open(args.config, "r", encoding="utf-8") as config_file:
+        config = json.load(config_file)
+
+    data_path = Path(*config.get("data_path", ["..", "data"]))
+    paths = {
+        dataset_key: data_path / f"{dataset_key}.json"
+        for dataset_key in SNAPSHOT_DATASET_KEYS
+    }
+    paths["sorted_datasets"] = data_path / "sorted_datasets"
+    loaded = {
+        dataset_key: [word for document in documents for word in document]
+        for dataset_key, documents in load_json_files(
+            source_files(paths, SNAPSHOT_DATASET_KEYS)
+        ).items()
+    }
+
+    # Words are copied so neither side shares `str` objects with the loaded JSON
+    tracemalloc.start()
+    sets: Dict[str, Set[str]] = {
+        dataset_key: {"".join(word) for word in words}
+        for dataset_key, words in loaded.items()
+    }
+    sets_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    start_time = perf_counter()
+    table = CompactWordTable(loaded)
+    build_time = perf_counter() - start_time
+    table_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    total_words = sum(len(words) for words in sets.values())
+    do_log(
+        f"Sets: {total_words} words across {len(sets)} datasets, {sets_memory / 1024 / 1024:.1f}MiB"
+    )
+    do_log(
+        f"Compact table: {table.count} unique words, {table_memory / 1024 / 1024:.1f}MiB "
+        f"({table.nbytes / 1024 / 1024:.1f}MiB of arrays), built in {build_time * 1000:.0f}ms"
+    )
+
+    all_words: List[str] = [word for words in sets.values() for word in words]
+    cases = {
+        "hit": random.choices(all_words, k=args.lookups),
+        "miss": [f"{word}qx" for word in random.choices(all_words, k=args.lookups)],
+    }
+    mask = sum(DATASET_TAGS[dataset_key] for dataset_key in sets)
+    for case, words in cases.items():
+        start_time = perf_counter()
+        for word in words:
+            any(word in dataset for dataset in sets.values())
+        sets_time = perf_counter() - start_time
+
+        start_time = perf_counter()
+        for word in words:
+            table.flags(word) & mask
+        table_time = perf_counter() - start_time
+
+        do_log(
+            f"Lookup ({case}): sets {sets_time / len(words) * 1e9:.0f}ns, "
+            f"compact table {table_time / len(words) * 1e9:.0f}ns"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import asyncio
+from time import monotonic
+from typing import Dict, List, Optional
+
+from utils import do_log
+from websockets.exceptions import ConnectionClosed
+
+# Sent to clients closed for falling behind or going quiet, they should reconnect and SYNC_SINCE
+SLOW_CONSUMER_CLOSE_CODE = 1013
+IDLE_CLOSE_CODE = 1001
+
+
+class Connection:
+    """
+    An authenticated websocket. Broadcasts are queued and written by the connection's own writer task, so a slow
+    client only ever holds up itself, and at most 'max_queued' frames are kept for it.
+    """
+
+    def __init__(self, websocket, client_id: str, max_queued: int):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.connected_at = monotonic()
+        self.last_activity = self.connected_at
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.queue: asyncio.Queue[str] = asyncio.Queue(max_queued)
+        self.writer_task = asyncio.create_task(self.writer())
+
+    def touch(self):
+        self.last_activity = monotonic()
+
+    def record_sent(self, data):
+        self.bytes_sent += len(data)
+        self.messages_sent += 1
+
+    def enqueue(self, data: str) -> bool:
+        """
+        Queues a broadcast frame, returning False if the connection's queue is full.
+        """
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def writer(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                await self.websocket.send(data)
+                self.record_sent(data)
+        except ConnectionClosed:
+            pass
+
+    def stats(self) -> Dict:
+        now = monotonic()
+        return {
+            "client_id": self.client_id,
+            "connected_s": round(now - self.connected_at),
+            "idle_s": round(now - self.last_activity),
+            "bytes_sent": self.bytes_sent,
+            "messages_sent": self.messages_sent,
+            "queued": self.queue.qsize(),
+        }
+
+
+class ConnectionRegistry:
+    """
+    Tracks every authenticated connection, keyed by its websocket so registering and dropping one is O(1) however
+    many come and go. Connections that stop keeping up with broadcasts, or send nothing for 'idle_timeout_seconds'
+    (0 to never time out), are closed.
+    """
+
+    def __init__(self, max_queued: int = 256, idle_timeout_seconds: float = 0):
+        self.max_queued = max_queued
+        self.idle_timeout = idle_timeout_seconds
+        self.connections: Dict[object, Connection] = {}
+        self.evicted = 0
+        self.sweep_task: Optional[asyncio.Task] = None
+        if self.idle_timeout > 0:
+            self.sweep_task = asyncio.create_task(self.sweep_idle())
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def get(self, websocket) -> Optional[Connection]:
+        return self.connections.get(websocket)
+
+    def register(self, websocket, client_id: str) -> Connection:
+        connection = Connection(websocket, client_id, self.max_queued)
+        self.connections[websocket] = connection
+        return connection
+
+    def unregister(self, websocket) -> Optional[Connection]:
+        connection = self.connections.pop(websocket, None)
+        if connection is not None:
+            connection.writer_task.cancel()
+        return connection
+
+    def evict(self, connection: Connection, code: int, reason: str):
+        if self.unregister(connection.websocket) is None:
+            return
+        self.evicted += 1
+        do_log(f"[WS] Closing {connection.client_id}: {reason}")
+        asyncio.create_task(connection.websocket.close(code=code, reason=reason))
+
+    def broadcast(self, data: str) -> int:
+        """
+        Queues 'data' for every connection, closing any whose queue is already full. Returns how many were closed.
+        """
+        slow: List[Connection] = [
+            connection
+            for connection in self.connections.values()
+            if not connection.enqueue(data)
+        ]
+        for connection in slow:
+            self.evict(connection, SLOW_CONSUMER_CLOSE_CODE, "Slow consumer")
+        return len(slow)
+
+    async def sweep_idle(self):
+        interval = min(self.idle_timeout / 2, 60)
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = monotonic() - self.idle_timeout
+            for connection in [
+                connection
+                for connection in self.connections.values()
+                if connection.last_activity < cutoff
+            ]:
+                self.evict(connection, IDLE_CLOSE_CODE, "Idle timeout")
+
+    def stats(self) -> Dict:
+        clients: Dict[str, int] = {}
+        for connection in self.connections.values():
+            clients[connection.client_id] = clients.get(connection.client_id, 0) + 1
+        return {
+            "connections": len(self.connections),
+            "clients": clients,
+            "queued": sum(c.queue.qsize() for c in self.connections.values()),
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,87 @@
+import asyncio
+import json
+from pathlib import Path
+from threading import Lock
+from time import perf_counter
+from typing import AbstractSet, Any, Dict, Iterator, List, Optional, Set
+
+from utils import do_log
+
+
+def load_json_file(path: Path) -> Any:
+    start_time = perf_counter()
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except Exception:
+        raise ValueError(f"{path} malformed or missing")
+    do_log(f"Loaded {path.as_posix()} ({(perf_counter() - start_time) * 1000:.0f}ms)")
+    return data
+
+
+def load_json_files(sources: Dict[str, List[Path]]) -> Dict[str, List[Any]]:
+    """
+    Reads and parses every file in 'sources', keeping results grouped by dataset and in order. Parsing holds the GIL,
+    so this is done one file at a time, startup is kept short by leaving rarely used datasets to `LazyDataset`.
+    """
+    return {
+        dataset_key: [load_json_file(path) for path in paths]
+        for dataset_key, paths in sources.items()
+    }
+
+
+class LazyDataset(AbstractSet[str]):
+    """
+    A read-only dataset that isn't read from disk until something first looks inside it. Looking inside blocks until
+    it's loaded, so the event loop should only do so once `loaded` is true, and use `load` or `start_loading` to have
+    it read on a worker thread.
+    """
+
+    def __init__(self, dataset_key: str, paths: List[Path]):
+        self.dataset_key = dataset_key
+        self.paths = paths
+        self.lock = Lock()
+        self._data: Optional[Set[str]] = None
+        self.load_task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    @property
+    def data(self) -> Set[str]:
+        if self._data is not None:
+            return self._data
+        with self.lock:
+            if self._data is None:
+                start_time = perf_counter()
+                data: Set[str] = set()
+                for path in self.paths:
+                    data.update(load_json_file(path))
+                self._data = data
+                do_log(
+                    f"Lazily loaded {self.dataset_key} "
+                    f"({len(data)} words, {(perf_counter() - start_time) * 1000:.0f}ms)"
+                )
+            return self._data
+
+    def start_loading(self) -> asyncio.Task:
+        """
+        Starts loading on a worker thread, unless that's already happened. Must be called from the event loop.
+        """
+        if self.load_task is None:
+            self.load_task = asyncio.create_task(asyncio.to_thread(lambda: self.data))
+        return self.load_task
+
+    async def load(self):
+        if self._data is None:
+            await self.start_loading()
+
+    def __contains__(self, word: object) -> bool:
+        return word in self.data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
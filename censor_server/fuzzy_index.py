@@ -0,0 +1,337 @@
+import json
+import random
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Protocol, Set, Tuple
+
+from dataset_loader import load_json_files
+from utils import do_log
+
+# Deletes are keyed by a truncated hash, then the length of the word they came from, then the word's source and
+# position in it, all packed in a 64-bit integer so the whole index is a single sorted array. Entries for one delete
+# are ordered by word length, so a lookup only reads the words whose length is within reach. Hash collisions only add
+# candidates, which are verified before being returned.
+POSITION_BITS = 24
+SOURCE_BITS = 4
+INDEX_BITS = POSITION_BITS + SOURCE_BITS
+LENGTH_BITS = 5
+HASH_SHIFT = INDEX_BITS + LENGTH_BITS
+HASH_MASK = (1 << (64 - HASH_SHIFT)) - 1
+INDEX_MASK = (1 << INDEX_BITS) - 1
+POSITION_MASK = (1 << POSITION_BITS) - 1
+# Longer words share the last length, and are told apart on verification
+MAX_LENGTH = (1 << LENGTH_BITS) - 1
+# Entries are collected in buckets by their top bits, so only one bucket at a time is sorted as Python ints
+BUCKET_BITS = 8
+
+
+def pattern_masks(word: str) -> Dict[str, int]:
+    """
+    Maps each character of 'word' to a bitmask of the positions it's at, for `osa_distance`.
+    """
+    masks: Dict[str, int] = {}
+    for position, char in enumerate(word):
+        masks[char] = masks.get(char, 0) | (1 << position)
+    return masks
+
+
+def osa_distance(masks: Dict[str, int], length: int, text: str) -> int:
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions) between the word of 'length'
+    characters that 'masks' came from and 'text'. This is Hyyrö's bit-parallel algorithm, which handles a whole column
+    of the distance table per character of 'text'. Python ints behave as infinitely sign-extended, so bits past the
+    word never reach the ones that are read, and nothing needs masking.
+    """
+    if length == 0:
+        return len(text)
+    vp = (1 << length) - 1
+    vn = 0
+    d0 = 0
+    previous = 0
+    last_bit = 1 << (length - 1)
+    distance = length
+    for char in text:
+        match = masks.get(char, 0)
+        transposed = (((~d0) & match) << 1) & previous
+        d0 = (((match & vp) + vp) ^ vp) | match | vn | transposed
+        hp = vn | ~(d0 | vp)
+        hn = d0 & vp
+        if hp & last_bit:
+            distance += 1
+        elif hn & last_bit:
+            distance -= 1
+        hp = (hp << 1) | 1
+        hn <<= 1
+        vp = hn | ~(d0 | hp)
+        vn = d0 & hp
+        previous = match
+    return distance
+
+
+def edit_distance(a: str, b: str) -> int:
+    return osa_distance(pattern_masks(a), len(a), b)
+
+
+def deletes(word: str, max_distance: int) -> Set[str]:
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {
+            variant[:i] + variant[i + 1 :]
+            for variant in frontier
+            for i in range(len(variant))
+        }
+        variants |= frontier
+    return variants
+
+
+class WordSource(Protocol):
+    """
+    Somewhere the indexed words live, so the index only has to keep their positions.
+    """
+
+    def word_at(self, position: int) -> str:
+        ...
+
+    def iter_positions(self) -> Iterator[Tuple[int, str]]:
+        ...
+
+
+class WordList:
+    """
+    A `WordSource` over a list, or a copy of any other iterable. The copy holds the set's own `str` objects, not new
+    ones.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words = words if isinstance(words, list) else list(words)
+
+    def word_at(self, position: int) -> str:
+        return self.words[position]
+
+    def iter_positions(self) -> Iterator[Tuple[int, str]]:
+        return enumerate(self.words)
+
+
+class TableWords:
+    """
+    A `WordSource` over the words of a `TaggedWordTable` carrying any of the bits in 'tag'. Words are decoded while
+    building and on lookup hits only.
+    """
+
+    def __init__(self, table, tag: int):
+        self.table = table
+        self.tag = tag
+
+    def word_at(self, position: int) -> str:
+        return self.table.word_at(position)
+
+    def iter_positions(self) -> Iterator[Tuple[int, str]]:
+        return self.table.iter_tagged_positions(self.tag)
+
+
+class FuzzyIndex:
+    """
+    A SymSpell-style symmetric delete index, suggesting existing words within a small edit distance of a new one.
+    Only the first `prefix_length` characters of each word are indexed, which bounds both memory and build time.
+    - Words aren't copied, entries point at a position in one of the `WordSource`s it was built from.
+    - `additions` holds words added after the build, and is searched linearly since it stays small.
+    - Lookups widen one edit at a time, and stop once there are enough suggestions. Short words have thousands of
+    neighbours two edits away, which would otherwise all be verified.
+    """
+
+    def __init__(self, max_distance: int = 2, prefix_length: int = 8):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.sources: List[WordSource] = []
+        self.entries = array("Q")
+        self.additions: List[str] = []
+        self.ready = False
+
+    def key(self, variant: str) -> int:
+        return (hash(variant) & HASH_MASK) << HASH_SHIFT
+
+    def build(self, sources: List[WordSource]):
+        start_time = perf_counter()
+        if len(sources) > 1 << SOURCE_BITS:
+            raise ValueError(f"Fuzzy index is limited to {1 << SOURCE_BITS} sources")
+
+        buckets = [array("Q") for _ in range(1 << BUCKET_BITS)]
+        word_count = 0
+        for source_number, source in enumerate(sources):
+            for position, word in source.iter_positions():
+                if position > POSITION_MASK:
+                    raise ValueError(
+                        f"Fuzzy index is limited to {POSITION_MASK + 1} words per source"
+                    )
+                index = (
+                    (min(len(word), MAX_LENGTH) << INDEX_BITS)
+                    | (source_number << POSITION_BITS)
+                    | position
+                )
+                for variant in deletes(word[: self.prefix_length], self.max_distance):
+                    entry = self.key(variant) | index
+                    buckets[entry >> (64 - BUCKET_BITS)].append(entry)
+                word_count += 1
+
+        entries = array("Q")
+        for position, bucket in enumerate(buckets):
+            entries.extend(sorted(bucket))
+            buckets[position] = array("Q")
+        self.sources = sources
+        self.entries = entries
+        self.ready = True
+
+        do_log(
+            f"Built fuzzy index ({word_count} words, {len(self.entries)} deletes, "
+            f"{self.entries.itemsize * len(self.entries) / 1024 / 1024:.1f}MiB, "
+            f"{perf_counter() - start_time:.1f}s)"
+        )
+
+    def word_at(self, index: int) -> str:
+        return self.sources[index >> POSITION_BITS].word_at(index & POSITION_MASK)
+
+    def add(self, word: str):
+        self.additions.append(word)
+
+    def lookup(self, word: str, limit: int = 3) -> List[str]:
+        """
+        Returns up to 'limit' existing words closest to 'word', excluding exact matches. Ties go to the
+        alphabetically first.
+        """
+        masks = pattern_masks(word)
+        matches: Dict[str, int] = {}
+
+        def verify(candidate: str):
+            if candidate != word and candidate not in matches:
+                distance = osa_distance(masks, len(word), candidate)
+                if distance <= self.max_distance:
+                    matches[candidate] = distance
+
+        for candidate in self.additions:
+            verify(candidate)
+
+        entries = self.entries
+        prefix = word[: self.prefix_length]
+        variants = deletes(prefix, self.max_distance)
+        seen: Set[int] = set()
+        for max_distance in range(1, self.max_distance + 1):
+            # Anything within 'max_distance' shares a delete this many characters from both prefixes, and is at most
+            # this many characters longer or shorter
+            low = min(max(len(word) - max_distance, 0), MAX_LENGTH) << INDEX_BITS
+            high = (min(len(word) + max_distance, MAX_LENGTH) + 1) << INDEX_BITS
+            found: Set[int] = set()
+            for variant in variants:
+                if len(prefix) - len(variant) > max_distance:
+                    continue
+                key = self.key(variant)
+                position = bisect_left(entries, key + low)
+                end = key + high
+                while position < len(entries) and entries[position] < end:
+                    found.add(entries[position] & INDEX_MASK)
+                    position += 1
+            found -= seen
+            seen |= found
+            for index in found:
+                verify(self.word_at(index))
+            # Every word within 'max_distance' has been verified, so these are sure to be the closest
+            if sum(1 for d in matches.values() if d <= max_distance) >= limit:
+                break
+
+        return [
+            candidate
+            for _, candidate in sorted(
+                (distance, candidate) for candidate, distance in matches.items()
+            )[:limit]
+        ]
+
+
+def typo(word: str) -> str:
+    """
+    'word' with a random deletion, substitution, insertion or transposition.
+    """
+    position = random.randrange(len(word))
+    char = random.choice("abcdefghijklmnopqrstuvwxyz")
+    edit = random.randrange(4)
+    if edit == 0:
+        return word[:position] + word[position + 1 :]
+    if edit == 1:
+        return word[:position] + char + word[position + 1 :]
+    if edit == 2:
+        return word[:position] + char + word[position:]
+    return (
+        word[:position]
+        + word[position + 1 : position + 2]
+        + word[position]
+        + word[position + 2 :]
+    )
+
+
+def main():
+    parser = ArgumentParser(
+        description="Times fuzzy index lookups of typos of indexed words, and checks them against a brute-force scan."
+    )
+    parser.add_argument(
+        "--config", help="Filepath for the config JSON file", default="config.json"
+    )
+    parser.add_argument("--lookups", help="Lookups to time", type=int, default=5000)
+    parser.add_argument(
+        "--verify",
+        help="Lookups to check against a brute-force scan",
+        type=int,
+        default=100,
+    )
+    args = parser.parse_args()
+    with open(args.config, "r", encoding="utf-8") as config_file:
+        config = json.load(config_file)
+
+    data_path = Path(*config.get("data_path", ["..", "data"]))
+    dataset_keys: List[str] = config.get(
+        "fuzzy_datasets", ["dictionary", "custom_old", "custom"]
+    )
+    loaded = load_json_files(
+        {
+            dataset_key: sorted((data_path / dataset_key).glob("*.json"))
+            if dataset_key == "sorted_datasets"
+            else [data_path / f"{dataset_key}.json"]
+            for dataset_key in dataset_keys
+        }
+    )
+    sources: List[WordSource] = [
+        WordList({word for document in documents for word in document})
+        for documents in loaded.values()
+    ]
+    index = FuzzyIndex(config.get("fuzzy_max_distance", 2))
+    index.build(sources)
+
+    words = [word for source in sources for _, word in source.iter_positions() if word]
+    queries = [typo(word) for word in random.choices(words, k=args.lookups)]
+    start_time = perf_counter()
+    results = [index.lookup(query) for query in queries]
+    lookup_time = perf_counter() - start_time
+    do_log(
+        f"Lookup: {lookup_time / len(queries) * 1e6:.0f}us per word over {len(queries)} typos"
+    )
+
+    unique_words = set(words)
+    mismatches = 0
+    for query, result in zip(queries[: args.verify], results):
+        closest = sorted(
+            (distance, word)
+            for word in unique_words
+            if word != query
+            and abs(len(word) - len(query)) <= index.max_distance
+            and (distance := edit_distance(query, word)) <= index.max_distance
+        )
+        if [word for _, word in closest[:3]] != result:
+            mismatches += 1
+    do_log(
+        f"Brute force: {mismatches} mismatches in {min(args.verify, len(queries))} lookups"
+    )
+
+
+if __name__ == "__main__":
+    main()
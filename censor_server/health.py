@@ -0,0 +1,37 @@
+import asyncio
+from collections import deque
+from typing import Deque, Optional
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag as how late a periodic sleep wakes up, keeping the last 'window' samples. A loop that's
+    wedged for good can't report anything, but the samples show stalls it recovered from.
+    """
+
+    def __init__(self, interval_ms: int = 500, window: int = 120):
+        self.interval = interval_ms / 1000
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start_time = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(loop.time() - start_time - self.interval, 0))
+
+    @property
+    def lag(self) -> float:
+        return self.samples[-1] if self.samples else 0
+
+    @property
+    def max_lag(self) -> float:
+        return max(self.samples, default=0)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
@@ -0,0 +1,145 @@
+import asyncio
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Callable, List, Optional, Tuple, TypedDict
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    word TEXT NOT NULL,
+    form TEXT NOT NULL,
+    is_username INTEGER NOT NULL,
+    requester TEXT NOT NULL,
+    requested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_form ON requests (form, is_username, requested_at);
+CREATE INDEX IF NOT EXISTS requests_requester ON requests (requester, requested_at);
+CREATE INDEX IF NOT EXISTS requests_time ON requests (requested_at);
+
+CREATE TABLE IF NOT EXISTS decisions (
+    id INTEGER PRIMARY KEY,
+    word TEXT NOT NULL,
+    form TEXT NOT NULL,
+    is_username INTEGER NOT NULL,
+    decision TEXT NOT NULL,
+    moderator TEXT NOT NULL,
+    decided_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS decisions_form ON decisions (form, is_username, decided_at);
+CREATE INDEX IF NOT EXISTS decisions_moderator ON decisions (moderator, decided_at);
+CREATE INDEX IF NOT EXISTS decisions_time ON decisions (decided_at);
+"""
+
+APPROVED = "approved"
+REJECTED = "rejected"
+AUTO_REJECTED = "auto_rejected"
+
+
+class Decision(TypedDict):
+    word: str
+    is_username: bool
+    decision: str
+    moderator: str
+    decided_at: float
+
+
+class DecisionHistory:
+    """
+    A SQLite store of every request and moderation decision, indexed by normalized word, requester and time.
+    Writes happen on a worker thread, lookups are indexed and cheap enough to run on the event loop.
+    """
+
+    def __init__(self, path: Path, normalizer: Callable[[str], str]):
+        self.normalizer = normalizer
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def write_sync(self, query: str, rows: List[Tuple]):
+        with self.lock, self.connection:
+            self.connection.executemany(query, rows)
+
+    async def record_requests(
+        self, words: List[str], is_username: bool, requester: str
+    ):
+        now = time()
+        rows = [
+            (word, self.normalizer(word), is_username, requester, now) for word in words
+        ]
+        await asyncio.to_thread(
+            self.write_sync,
+            "INSERT INTO requests (word, form, is_username, requester, requested_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    async def record_decisions(
+        self, words: List[str], is_username: bool, decision: str, moderator: str
+    ):
+        now = time()
+        rows = [
+            (word, self.normalizer(word), is_username, decision, moderator, now)
+            for word in words
+        ]
+        await asyncio.to_thread(
+            self.write_sync,
+            "INSERT INTO decisions (word, form, is_username, decision, moderator, decided_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def last_decision(self, word: str, is_username: bool) -> Optional[Decision]:
+        """
+        Returns the latest moderator decision on 'word' or anything sharing its normalized form. Automatic
+        rejections don't count, so they can't keep extending a rejection on their own.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT word, is_username, decision, moderator, decided_at FROM decisions "
+                "WHERE form = ? AND is_username = ? AND decision != ? ORDER BY decided_at DESC LIMIT 1",
+                (self.normalizer(word), is_username, AUTO_REJECTED),
+            ).fetchone()
+        return self.to_decision(row) if row is not None else None
+
+    def decisions_for(self, word: str, limit: int = 10) -> List[Decision]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT word, is_username, decision, moderator, decided_at FROM decisions "
+                "WHERE form = ? ORDER BY decided_at DESC LIMIT ?",
+                (self.normalizer(word), limit),
+            ).fetchall()
+        return [self.to_decision(row) for row in rows]
+
+    def request_stats(self, word: str) -> Tuple[int, int]:
+        """
+        Returns how many times 'word' was requested, and by how many different requesters.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT requester) FROM requests WHERE form = ?",
+                (self.normalizer(word),),
+            ).fetchone()
+
+    def requests_by(self, requester: str, limit: int = 10) -> List[Tuple[str, float]]:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT word, requested_at FROM requests WHERE requester = ? ORDER BY requested_at DESC LIMIT ?",
+                (requester, limit),
+            ).fetchall()
+
+    @staticmethod
+    def to_decision(row: Tuple) -> Decision:
+        return Decision(
+            word=row[0],
+            is_username=bool(row[1]),
+            decision=row[2],
+            moderator=row[3],
+            decided_at=row[4],
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from traceback import format_exc
 
@@ -29,6 +30,9 @@ async def on_message(message: discord.Message):
         try:
             await message.delete()
         finally:
+            whitelist_cog = bot.client.get_cog("WhitelistCog")
+            if whitelist_cog is not None:
+                await whitelist_cog.shutdown()
             await bot.client.close()
             await bot.client.logout()
             return
@@ -41,7 +45,11 @@ async def on_message(message: discord.Message):
     await bot.client.process_commands(message)
 
 
-async def post_init():
+async def boot():
+    """
+    Loads the datasets and starts the websocket server before logging in, so clients can sync without waiting on
+    Discord.
+    """
     await bot.client.add_cog(WhitelistCog(bot))
     await bot.client.add_cog(WebsocketManagerCog(bot))
 
@@ -58,27 +66,51 @@ async def config():
 
 @bot.client.event
 async def on_ready():
+    # Fires again after every reconnect, which must only refresh Discord state and never restart anything else
     try:
         utils.do_log(f"Bot name: {bot.client.user.name}")
         utils.do_log(f"Bot ID: {bot.client.user.id}")
         await config()
+        whitelist_cog = bot.client.get_cog("WhitelistCog")
+        whitelist_cog.bind_channels()
 
         utils.do_log("Ready\n\n")
-        bot.ready = True
-        await post_init()
+        bot.set_ready(True)
+        bot.discord_initialized = True
     except Exception:
+        if bot.discord_initialized:
+            utils.log_error(f"[Failed to refresh Discord state]\n{format_exc()}")
+            return
         utils.log_error(f"\n\n\nCRITICAL ERROR: FAILURE TO INITIALIZE{format_exc()}")
         await bot.client.close()
         await bot.client.logout()
         raise Exception("CRITICAL ERROR: FAILURE TO INITIALIZE")
 
 
+@bot.client.event
+async def on_disconnect():
+    # Discord-bound work is held back until the gateway is back, everything else keeps running
+    bot.set_ready(False)
+
+
+@bot.client.event
+async def on_resumed():
+    bot.set_ready(True)
+
+
+async def run(token: str):
+    async with bot.client:
+        await boot()
+        await bot.client.start(token)
+
+
 def main():
     global bot
-    bot.ready = False
+    bot.set_ready(False)
     utils.do_log("Loading Config")
 
     bot = utils.load_config_to_bot(bot)  # Load a json to the bot class
+    utils.set_log_levels(bot.CFG.get("log_levels", {}))
     load_dotenv(verbose=True)
 
     # Merge any env vars with config vars, and make variables easily accessible
@@ -87,7 +119,7 @@ def main():
     # DiscordPy tasks
     utils.do_log("Loaded Config")
     utils.do_log("Logging in")
-    bot.client.run(os.getenv("DISCORD_TOKEN"))
+    asyncio.run(run(os.getenv("DISCORD_TOKEN", "")))
     utils.do_log("Logging out")
 
 
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import struct
+import zlib
+from hashlib import blake2b, sha256
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils import do_log
+
+# XOR8 filter binary format, little-endian. All integers are unsigned.
+# Header: magic (b"XOR8"), format version (u16), fingerprint bits (u16), seed (u64), dataset version (u64),
+# block length (u32), 4 padding bytes. Then `3 * block_length` one-byte fingerprints.
+MAGIC = b"XOR8"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHQQI4x")
+
+# Each lookup compares one 8-bit fingerprint, so a word that was never added matches with probability 1/256
+FALSE_POSITIVE_RATE = 1 / 256
+MAX_ATTEMPTS = 100
+MASK_32 = 0xFFFFFFFF
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def word_hash(word: str, seed: int) -> int:
+    """
+    64-bit keyed BLAKE2b of the UTF-8 word, read little-endian. Clients must hash words the same way.
+    """
+    digest = blake2b(
+        word.encode("utf-8"), digest_size=8, key=seed.to_bytes(8, "little")
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+def rotate_left(value: int, bits: int) -> int:
+    return ((value << bits) | (value >> (64 - bits))) & MASK_64
+
+
+def slots(hashed: int, block_length: int) -> Tuple[int, int, int]:
+    """
+    The three fingerprint slots for a hash, one in each block. Each is `(rotl64(hash, r) & 0xFFFFFFFF) * block_length
+    >> 32` for r = 0, 21 and 42, offset by its block.
+    """
+    return (
+        ((hashed & MASK_32) * block_length) >> 32,
+        (((rotate_left(hashed, 21) & MASK_32) * block_length) >> 32) + block_length,
+        (((rotate_left(hashed, 42) & MASK_32) * block_length) >> 32) + 2 * block_length,
+    )
+
+
+def fingerprint(hashed: int) -> int:
+    return (hashed ^ (hashed >> 32)) & 0xFF
+
+
+class Xor8Filter:
+    """
+    An XOR filter over a set of words: about 9.84 bits per word, no false negatives and a false positive rate of
+    `FALSE_POSITIVE_RATE`. It can't be added to once built, later additions have to be sent alongside it.
+    """
+
+    def __init__(self, seed: int, version: int, block_length: int, fingerprints: bytes):
+        self.seed = seed
+        self.version = version
+        self.block_length = block_length
+        self.fingerprints = fingerprints
+
+    def __contains__(self, word: object) -> bool:
+        if not isinstance(word, str):
+            return False
+        hashed = word_hash(word, self.seed)
+        slot_0, slot_1, slot_2 = slots(hashed, self.block_length)
+        return fingerprint(hashed) == (
+            self.fingerprints[slot_0]
+            ^ self.fingerprints[slot_1]
+            ^ self.fingerprints[slot_2]
+        )
+
+    def to_bytes(self) -> bytes:
+        return (
+            HEADER.pack(
+                MAGIC, FORMAT_VERSION, 8, self.seed, self.version, self.block_length
+            )
+            + self.fingerprints
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Xor8Filter":
+        magic, format_version, _, seed, version, block_length = HEADER.unpack_from(data)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError("Not a supported XOR8 filter")
+        return cls(seed, version, block_length, data[HEADER.size :])
+
+
+def build_filter(words: Iterable[str], version: int) -> Xor8Filter:
+    """
+    Builds an `Xor8Filter` by peeling: repeatedly removing words that are alone in some slot, then assigning
+    fingerprints in reverse. Peeling occasionally gets stuck, in which case it's retried with the next seed.
+    """
+    unique_words = set(words)
+    block_length = (32 + int(1.23 * len(unique_words)) + 2) // 3
+    capacity = block_length * 3
+
+    for seed in range(1, MAX_ATTEMPTS + 1):
+        hashes = [word_hash(word, seed) for word in unique_words]
+        counts = [0] * capacity
+        xor_masks = [0] * capacity
+        for hashed in hashes:
+            for slot in slots(hashed, block_length):
+                counts[slot] += 1
+                xor_masks[slot] ^= hashed
+
+        stack: List[Tuple[int, int]] = []
+        queue = [slot for slot in range(capacity) if counts[slot] == 1]
+        while queue:
+            slot = queue.pop()
+            if counts[slot] != 1:
+                continue
+            hashed = xor_masks[slot]
+            stack.append((slot, hashed))
+            for other_slot in slots(hashed, block_length):
+                counts[other_slot] -= 1
+                xor_masks[other_slot] ^= hashed
+                if counts[other_slot] == 1:
+                    queue.append(other_slot)
+
+        if len(stack) == len(hashes):
+            fingerprints = bytearray(capacity)
+            for slot, hashed in reversed(stack):
+                slot_0, slot_1, slot_2 = slots(hashed, block_length)
+                fingerprints[slot] = (
+                    fingerprint(hashed)
+                    ^ fingerprints[slot_0]
+                    ^ fingerprints[slot_1]
+                    ^ fingerprints[slot_2]
+                )
+            return Xor8Filter(seed, version, block_length, bytes(fingerprints))
+
+    raise ValueError(f"Couldn't build a filter in {MAX_ATTEMPTS} attempts")
+
+
+class FilterArtifact:
+    """
+    A built filter along with its serialized form, and the sizes of the JSON list it replaces for comparison.
+    """
+
+    def __init__(self, xor_filter: Xor8Filter, word_count: int, json_size: int):
+        self.filter = xor_filter
+        self.data = xor_filter.to_bytes()
+        self.sha256 = sha256(self.data).hexdigest()
+        self.word_count = word_count
+        self.json_size = json_size
+
+    def metadata(self) -> Dict:
+        return {
+            "version": self.filter.version,
+            "type": "xor8",
+            "hash": "blake2b-64",
+            "seed": self.filter.seed,
+            "block_length": self.filter.block_length,
+            "false_positive_rate": FALSE_POSITIVE_RATE,
+            "words": self.word_count,
+            "size": len(self.data),
+            "json_size": self.json_size,
+            "sha256": self.sha256,
+        }
+
+
+def build_artifact(version: int, datasets: List[Iterable[str]]) -> FilterArtifact:
+    start_time = perf_counter()
+    words = sorted(set().union(*datasets))
+    xor_filter = build_filter(words, version)
+    json_data = json.dumps(words, separators=(",", ":")).encode("utf-8")
+    artifact = FilterArtifact(xor_filter, len(words), len(json_data))
+    do_log(
+        f"[Built v{version} membership filter ({len(words)} words, {len(artifact.data)} bytes, "
+        f"{len(artifact.data) * 8 / max(len(words), 1):.2f} bits/word) vs {len(json_data)} bytes as JSON "
+        f"({len(zlib.compress(json_data))} compressed), {(perf_counter() - start_time) * 1000:.0f}ms]"
+    )
+    return artifact
+
+
+class FilterCache:
+    """
+    Holds the latest `FilterArtifact`. Additions since it was built are served as an exact exception list, and once
+    there are more than 'rebuild_threshold' of them a rebuild is started in the background.
+    - 'collect_func' is called on the event loop and must return the current version along with datasets that are
+    safe to iterate from a worker thread.
+    - 'additions_func' returns the words added after a version, or None if they can no longer be listed.
+    """
+
+    def __init__(
+        self,
+        collect_func: Callable[[], Tuple[int, List[Iterable[str]]]],
+        additions_func: Callable[[int], Optional[List[str]]],
+        rebuild_threshold: int = 1000,
+    ):
+        self.collect_func = collect_func
+        self.additions_func = additions_func
+        self.rebuild_threshold = rebuild_threshold
+        self.artifact: Optional[FilterArtifact] = None
+        self.lock = asyncio.Lock()
+        self.rebuild_task: Optional[asyncio.Task] = None
+
+    async def rebuild(self) -> FilterArtifact:
+        async with self.lock:
+            version, datasets = self.collect_func()
+            if self.artifact is None or self.artifact.filter.version != version:
+                self.artifact = await asyncio.to_thread(
+                    build_artifact, version, datasets
+                )
+            return self.artifact
+
+    def rebuilding(self) -> bool:
+        return self.rebuild_task is not None and not self.rebuild_task.done()
+
+    def on_addition(self):
+        """
+        Starts a background rebuild once the exception list has outgrown 'rebuild_threshold'.
+        """
+        if self.artifact is None or self.rebuilding():
+            return
+        additions = self.additions_func(self.artifact.filter.version)
+        if additions is None or len(additions) > self.rebuild_threshold:
+            self.rebuild_task = asyncio.create_task(self.rebuild())
+
+    async def get(self) -> Tuple[FilterArtifact, List[str]]:
+        """
+        Returns the current filter along with every word added since it was built.
+        """
+        artifact = self.artifact
+        additions = (
+            self.additions_func(artifact.filter.version)
+            if artifact is not None
+            else None
+        )
+        if artifact is None or additions is None:
+            artifact = await self.rebuild()
+            additions = self.additions_func(artifact.filter.version) or []
+        return artifact, additions
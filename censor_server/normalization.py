@@ -0,0 +1,110 @@
+import json
+import re
+from hashlib import sha256
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_STEPS = ["casefold", "strip_punctuation", "leet", "collapse_repeats"]
+
+DEFAULT_LEET_MAP = {
+    "0": "o",
+    "1": "i",
+    "3": "e",
+    "4": "a",
+    "5": "s",
+    "7": "t",
+    "@": "a",
+    "$": "s",
+}
+
+# Only runs of three or more are collapsed, so real double letters ("too", "ass") are left alone
+REPEAT_PATTERN = re.compile(r"(.)\1{2,}")
+PUNCTUATION = "!\"#%&'()*+,-./:;<=>?[\\]^_`{|}~"
+
+
+class Normalizer:
+    """
+    Reduces a word to a normalized form by running the configured steps in order.
+    - `casefold` lowercases, including non-ASCII.
+    - `strip_punctuation` removes leading and trailing punctuation.
+    - `leet` replaces leetspeak characters using 'leet_map'.
+    - `collapse_repeats` turns runs of three or more of the same character into one ("soooo" -> "so").
+    """
+
+    def __init__(
+        self,
+        steps: Optional[List[str]] = None,
+        leet_map: Optional[Dict[str, str]] = None,
+    ):
+        self.steps = DEFAULT_STEPS if steps is None else steps
+        leet_map = DEFAULT_LEET_MAP if leet_map is None else leet_map
+        self.leet_table = str.maketrans(leet_map)
+        # Identifies the configuration, so forms precomputed into a word table can be checked against it
+        self.fingerprint = int.from_bytes(
+            sha256(
+                json.dumps([self.steps, sorted(leet_map.items())]).encode()
+            ).digest()[:8],
+            "little",
+        )
+        step_funcs: Dict[str, Callable[[str], str]] = {
+            "casefold": str.casefold,
+            "strip_punctuation": lambda word: word.strip(PUNCTUATION),
+            "leet": lambda word: word.translate(self.leet_table),
+            "collapse_repeats": lambda word: REPEAT_PATTERN.sub(r"\1", word),
+        }
+        unknown_steps = [step for step in self.steps if step not in step_funcs]
+        if unknown_steps:
+            raise ValueError(f"Unknown normalization steps: {unknown_steps}")
+        self.step_funcs = [step_funcs[step] for step in self.steps]
+
+    def __call__(self, word: str) -> str:
+        for step_func in self.step_funcs:
+            word = step_func(word)
+        return word
+
+
+def form_entries(
+    words: Iterable[str], normalizer: Normalizer
+) -> List[Tuple[bytes, int]]:
+    """
+    Pairs the UTF-8 normalized form of every word not already in normalized form with the word's position in
+    'words', sorted by form. A form shared by several words keeps the first of them.
+    """
+    positions: Dict[str, int] = {}
+    for position, word in enumerate(words):
+        form = normalizer(word)
+        if form != word:
+            positions.setdefault(form, position)
+    return sorted(
+        (form.encode("utf-8"), position) for form, position in positions.items()
+    )
+
+
+class NormalizedIndex:
+    """
+    Maps normalized forms back to the canonical dataset entries they came from. Entries that are already in
+    normalized form are left out, since an exact lookup finds them anyway.
+    """
+
+    def __init__(self, normalizer: Normalizer):
+        self.normalizer = normalizer
+        self.forms: Dict[str, str] = {}
+        self.build_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self.forms)
+
+    def build(self, datasets: Iterable[Iterable[str]]):
+        start_time = perf_counter()
+        for dataset in datasets:
+            for word in dataset:
+                self.add(word)
+        self.build_time = perf_counter() - start_time
+
+    def add(self, word: str):
+        form = self.normalizer(word)
+        if form != word:
+            self.forms.setdefault(form, word)
+
+    def get(self, form: str) -> Optional[str]:
+        return self.forms.get(form)
@@ -0,0 +1,133 @@
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple, cast
+
+from utils import do_log
+
+
+class PendingRequest:
+    """
+    A word or username awaiting a decision. `message_id` and `channel_id` are unset until its Discord message is
+    posted.
+    """
+
+    def __init__(self, word: str, is_username: bool, requester: str):
+        self.word = word
+        self.is_username = is_username
+        self.requesters: List[str] = [requester]
+        self.requested_at = time()
+        self.message_id: Optional[int] = None
+        self.channel_id: Optional[int] = None
+
+    @property
+    def command(self) -> str:
+        return f"{'!userwhitelist' if self.is_username else '!whitelist'} {self.word}"
+
+    def to_dict(self) -> Dict:
+        return {
+            "word": self.word,
+            "is_username": self.is_username,
+            "requesters": self.requesters,
+            "requested_at": self.requested_at,
+            "message_id": self.message_id,
+            "channel_id": self.channel_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PendingRequest":
+        request = cls(data["word"], data["is_username"], "")
+        request.requesters = data["requesters"]
+        request.requested_at = data["requested_at"]
+        request.message_id = data["message_id"]
+        request.channel_id = data["channel_id"]
+        return request
+
+
+class PendingRequests:
+    """
+    An index of requests awaiting moderation, keyed by normalized word and request type, so repeat requests attach
+    to the entry already posted instead of being posted again.
+    - `by_message` maps posted messages back to their request, so reactions can be resolved without fetching the
+    message. It's capped at 'max_messages', dropping the oldest posts first, which then fall back to a fetch.
+    - 'on_change' is called whenever posted requests are added or removed, for the owner to persist them.
+    """
+
+    def __init__(
+        self,
+        normalizer: Callable[[str], str],
+        max_messages: int = 5000,
+        on_change: Optional[Callable[[], None]] = None,
+    ):
+        self.normalizer = normalizer
+        self.max_messages = max_messages
+        self.on_change = on_change
+        self.requests: Dict[Tuple[str, bool], PendingRequest] = {}
+        self.by_message: Dict[int, PendingRequest] = {}
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def key(self, word: str, is_username: bool) -> Tuple[str, bool]:
+        return self.normalizer(word), is_username
+
+    def get(self, word: str, is_username: bool) -> Optional[PendingRequest]:
+        return self.requests.get(self.key(word, is_username))
+
+    def reserve(self, word: str, is_username: bool, requester: str) -> PendingRequest:
+        request = PendingRequest(word, is_username, requester)
+        self.requests[self.key(word, is_username)] = request
+        return request
+
+    def bind(self, word: str, is_username: bool, message_id: int, channel_id: int):
+        """
+        Records the Discord message a reserved request was posted as.
+        """
+        request = self.get(word, is_username)
+        if request is None or request.message_id is not None:
+            request = self.reserve(word, is_username, "")
+        request.message_id = message_id
+        request.channel_id = channel_id
+        self.by_message[message_id] = request
+
+        while len(self.by_message) > self.max_messages:
+            self.forget(self.by_message[next(iter(self.by_message))])
+        if self.on_change is not None:
+            self.on_change()
+
+    def forget(self, request: PendingRequest):
+        key = self.key(request.word, request.is_username)
+        if self.requests.get(key) is request:
+            del self.requests[key]
+        if request.message_id is not None:
+            self.by_message.pop(request.message_id, None)
+            if self.on_change is not None:
+                self.on_change()
+
+    def release(self, word: str, is_username: bool) -> Optional[PendingRequest]:
+        request = self.get(word, is_username)
+        if request is not None:
+            self.forget(request)
+        return request
+
+    def release_reserved(self, word: str, is_username: bool):
+        """
+        Releases 'word' only if it's reserved and not yet posted.
+        """
+        request = self.get(word, is_username)
+        if request is not None and request.message_id is None:
+            self.forget(request)
+
+    def pop_message(self, message_id: int) -> Optional[PendingRequest]:
+        request = self.by_message.get(message_id)
+        if request is not None:
+            self.forget(request)
+        return request
+
+    def to_json(self) -> List[Dict]:
+        return [request.to_dict() for request in self.by_message.values()]
+
+    def load(self, data: List[Dict]):
+        for request_data in data[-self.max_messages :]:
+            request = PendingRequest.from_dict(request_data)
+            self.requests[self.key(request.word, request.is_username)] = request
+            self.by_message[cast(int, request.message_id)] = request
+        do_log(f"Loaded {len(self.by_message)} pending requests")
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+from threading import Lock
+from traceback import format_exc
+from typing import Any, Awaitable, Callable, List, Optional, Set, TypedDict
+
+from utils import log_error
+
+
+class JournalEntry(TypedDict):
+    version: int
+    word: str
+    is_username: bool
+
+
+def write_json_atomic(path: Path, data: Any, indent: Optional[int] = None):
+    """
+    Writes 'data' to a temporary file beside 'path' and swaps it into place, so a crash mid-write never leaves a
+    truncated file behind.
+    """
+    temp_path = path.with_name(f"{path.name}.tmp")
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class Journal:
+    """
+    A write-ahead journal of approvals. Every entry is fsynced as it's appended, so the sorted JSON files only need
+    to be rewritten periodically during compaction.
+    - Compaction first seals the live journal to `<name>.sealed` and starts a new one, then the caller writes its
+    snapshot, then the sealed segment is deleted. Replay reads both, so a crash at any point loses nothing.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.sealed_path = path.with_name(f"{path.name}.sealed")
+        self.lock = Lock()
+        self.entry_count = 0
+        self.file = open(self.path, "a")
+
+    def replay(self) -> List[JournalEntry]:
+        entries: List[JournalEntry] = []
+        for path in (self.sealed_path, self.path):
+            if not path.exists():
+                continue
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break  # A torn final write, nothing after it was acknowledged
+        self.entry_count = len(entries)
+        return entries
+
+    def append_sync(self, entries: List[JournalEntry]):
+        with self.lock:
+            self.file.writelines(json.dumps(entry) + "\n" for entry in entries)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.entry_count += len(entries)
+
+    async def append(self, version: int, word: str, is_username: bool):
+        entry = JournalEntry(version=version, word=word, is_username=is_username)
+        await asyncio.to_thread(self.append_sync, [entry])
+
+    async def append_many(self, entries: List[JournalEntry]):
+        """
+        Appends a batch of entries with a single fsync.
+        """
+        await asyncio.to_thread(self.append_sync, entries)
+
+    def seal(self):
+        """
+        Moves the live journal aside so a snapshot can be taken while new approvals keep being journaled.
+        """
+        with self.lock:
+            self.file.close()
+            if self.sealed_path.exists():
+                # A previous compaction never finished, keep its entries ahead of ours
+                with open(self.sealed_path, "a") as sealed, open(self.path, "r") as f:
+                    sealed.write(f.read())
+                    sealed.flush()
+                    os.fsync(sealed.fileno())
+                self.path.unlink()
+            else:
+                os.replace(self.path, self.sealed_path)
+            self.file = open(self.path, "a")
+            self.entry_count = 0
+
+    def discard_sealed(self):
+        self.sealed_path.unlink(missing_ok=True)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class FlushScheduler:
+    """
+    Coalesces saves. Callers mark datasets dirty, and 'flush_func' is called with every dirty dataset 'interval_ms'
+    after the first change, so a burst of changes costs a single write per dataset.
+    """
+
+    def __init__(
+        self, flush_func: Callable[[Set[str]], Awaitable[None]], interval_ms: int
+    ):
+        self.flush_func = flush_func
+        self.interval = interval_ms / 1000
+        self.dirty: Set[str] = set()
+        self.dirty_event = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = asyncio.create_task(self.run())
+
+    def mark_dirty(self, key: str):
+        self.dirty.add(key)
+        self.dirty_event.set()
+
+    async def run(self):
+        while True:
+            await self.dirty_event.wait()
+            # Give the rest of a burst time to land before writing
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.flush()
+            except Exception:
+                log_error(f"[Flush failed]\n{format_exc()}")
+
+    async def flush(self):
+        async with self.lock:
+            self.dirty_event.clear()
+            if not self.dirty:
+                return
+            keys, self.dirty = self.dirty, set()
+            try:
+                await self.flush_func(keys)
+            except Exception:
+                # Retry on the next cycle rather than losing track of what's unsaved
+                self.dirty.update(keys)
+                self.dirty_event.set()
+                raise
+
+    async def shutdown(self):
+        self.task.cancel()
+        await self.flush()
@@ -0,0 +1,103 @@
+from time import monotonic
+from typing import Dict, Optional, Tuple, TypedDict
+
+# Function key for a limit shared by every function a client calls
+ALL_FUNCTIONS = "*"
+
+
+class BucketConfig(TypedDict):
+    per_second: float
+    burst: int
+
+
+def validate_bucket_config(config: BucketConfig, name: str):
+    if not config.get("per_second", 0) > 0 or not config.get("burst", 0) >= 1:
+        raise ValueError(
+            f"Rate limit for {name} needs a positive per_second and a burst of at least 1, got {config}"
+        )
+
+
+class TokenBucket:
+    """
+    Holds up to 'burst' tokens, refilled at 'per_second'.
+    """
+
+    def __init__(self, per_second: float, burst: int):
+        self.per_second = per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """
+        Takes 'cost' tokens if there are enough, returning 0. Otherwise takes nothing and returns the seconds until
+        there will be.
+        """
+        now = monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.per_second
+        )
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.per_second
+
+
+class RateLimiter:
+    """
+    Token buckets per client id and function. 'limits' maps function names (or `ALL_FUNCTIONS`) to a bucket config,
+    and 'client_limits' overrides them for particular client ids. Functions without a limit are never limited, while
+    a limit has to refill at a positive rate.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, BucketConfig]] = None,
+        client_limits: Optional[Dict[str, Dict[str, BucketConfig]]] = None,
+    ):
+        self.limits = limits or {}
+        self.client_limits = client_limits or {}
+        for func, config in self.limits.items():
+            validate_bucket_config(config, func)
+        for client_id, client_config in self.client_limits.items():
+            for func, config in client_config.items():
+                validate_bucket_config(config, f"{client_id} {func}")
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.limited = 0
+
+    def bucket(self, client_id: str, func: str) -> Optional[TokenBucket]:
+        key = (client_id, func)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            config = self.client_limits.get(client_id, {}).get(func) or self.limits.get(
+                func
+            )
+            if config is None:
+                return None
+            bucket = TokenBucket(config["per_second"], config["burst"])
+            self.buckets[key] = bucket
+        return bucket
+
+    def check(self, client_id: str, func: str) -> float:
+        """
+        Returns 0 if the call is admitted, or how many seconds to wait before retrying. A call takes a token from the
+        function's bucket and from the client's `ALL_FUNCTIONS` bucket, and is refused if either is empty.
+        """
+        buckets = [
+            bucket
+            for bucket in (
+                self.bucket(client_id, func),
+                self.bucket(client_id, ALL_FUNCTIONS),
+            )
+            if bucket is not None
+        ]
+        for position, bucket in enumerate(buckets):
+            retry_after = bucket.take()
+            if retry_after:
+                # Give back what the earlier bucket took, the call isn't happening
+                for taken in buckets[:position]:
+                    taken.tokens += 1
+                self.limited += 1
+                return retry_after
+        return 0
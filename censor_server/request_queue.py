@@ -0,0 +1,164 @@
+import asyncio
+from itertools import count
+from time import monotonic
+from traceback import format_exc
+from typing import Awaitable, Callable, Dict, Optional
+
+from utils import do_log, log_error
+
+
+class RequestJob:
+    def __init__(
+        self,
+        job_id: str,
+        data: Dict,
+        on_done: Callable[["RequestJob", bool], Awaitable[None]],
+    ):
+        self.job_id = job_id
+        self.data = data
+        self.on_done = on_done
+        self.enqueued_at = monotonic()
+        self.wait_time = 0.0
+
+
+class QueueSlot:
+    """
+    Room held in a `RequestQueue` for a job that's still being prepared. It's used up by submitting the job, or given
+    back by `release`, whichever comes first.
+    """
+
+    def __init__(self, queue: "RequestQueue"):
+        self.queue = queue
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.queue.reserved -= 1
+
+
+class RequestQueue:
+    """
+    An in-process job queue for Discord-bound whitelist requests. Submitting returns a job id straight away, and a
+    bounded pool of workers runs 'process_func' on each job in the background, calling the job's `on_done` after.
+    - There's room for 'max_outstanding' queued, running and reserved jobs (0 for no limit). Jobs that take awaiting
+    to prepare should `reserve` a slot first, so the check and the submit can't be split by other callers.
+    """
+
+    def __init__(
+        self,
+        process_func: Callable[[Dict], Awaitable],
+        workers: int = 2,
+        max_outstanding: int = 0,
+    ):
+        self.process_func = process_func
+        self.queue: asyncio.Queue[RequestJob] = asyncio.Queue()
+        self.job_ids = count(1)
+        self.worker_count = workers
+        self.max_outstanding = max_outstanding
+
+        self.active = 0
+        self.reserved = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(workers)]
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    @property
+    def outstanding(self) -> int:
+        return self.depth + self.active + self.reserved
+
+    @property
+    def full(self) -> bool:
+        return 0 < self.max_outstanding <= self.outstanding
+
+    def retry_after(self) -> float:
+        """
+        Roughly how long until a slot frees up, going by how long jobs have taken so far.
+        """
+        finished = self.completed + self.failed
+        average_run = self.total_run / finished if finished else 1.0
+        return max(average_run / self.worker_count, 1.0)
+
+    def reserve(self) -> Optional[QueueSlot]:
+        """
+        Holds a slot for a job about to be submitted, or returns None if the queue is full.
+        """
+        if self.full:
+            return None
+        self.reserved += 1
+        return QueueSlot(self)
+
+    def submit(
+        self,
+        data: Dict,
+        on_done: Callable[[RequestJob, bool], Awaitable[None]],
+        slot: Optional[QueueSlot] = None,
+    ) -> str:
+        """
+        Queues a job, in 'slot' if one was reserved for it. Raises `asyncio.QueueFull` if there's no room otherwise.
+        """
+        if slot is not None and slot.held:
+            slot.release()
+        elif self.full:
+            raise asyncio.QueueFull
+        job = RequestJob(str(next(self.job_ids)), data, on_done)
+        self.queue.put_nowait(job)
+        return job.job_id
+
+    def stats(self) -> Dict:
+        started = self.completed + self.failed + self.active
+        return {
+            "depth": self.depth,
+            "active": self.active,
+            "reserved": self.reserved,
+            "completed": self.completed,
+            "failed": self.failed,
+            "average_wait_ms": round(self.total_wait / started * 1000)
+            if started
+            else 0,
+            "max_wait_ms": round(self.max_wait * 1000),
+            "outstanding": self.outstanding,
+        }
+
+    async def worker(self):
+        while True:
+            job = await self.queue.get()
+            job.wait_time = monotonic() - job.enqueued_at
+            self.total_wait += job.wait_time
+            self.max_wait = max(self.max_wait, job.wait_time)
+            self.active += 1
+
+            success = True
+            run_start = monotonic()
+            try:
+                await self.process_func(job.data)
+            except Exception:
+                success = False
+                log_error(f"[Request job {job.job_id} failed]\n{format_exc()}")
+            finally:
+                self.total_run += monotonic() - run_start
+                self.active -= 1
+                if success:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.queue.task_done()
+
+            do_log(
+                f"[Request job {job.job_id} done after waiting {job.wait_time * 1000:.0f}ms "
+                f"(depth {self.depth})]"
+            )
+            try:
+                await job.on_done(job, success)
+            except Exception:
+                log_error(
+                    f"[Request job {job.job_id} notification failed]\n{format_exc()}"
+                )
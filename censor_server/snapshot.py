@@ -0,0 +1,347 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from argparse import ArgumentParser
+from hashlib import sha256
+from pathlib import Path
+from typing import (
+    AbstractSet,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Protocol,
+    Tuple,
+)
+
+from dataset_loader import load_json_files
+from normalization import Normalizer, form_entries
+from utils import do_log
+
+# Layout (little-endian):
+# - Header: magic, format version, reserved, source fingerprint, dataset version, entry count, form count,
+#   normalizer fingerprint (0 if built without forms)
+# - Offset tables: one u32 per entry, then one u32 per form, both relative to the start of the entry area
+# - Entry area: per entry, a u16 dataset tag bitmask, a u16 byte length, then the UTF-8 word
+# - Form area, following the entries: per form, the u32 position of the entry it normalizes, a u16 byte length,
+#   then the UTF-8 form
+# Entries and forms are sorted by their UTF-8 bytes so they can be binary searched in place.
+SNAPSHOT_MAGIC = b"WLSN"
+SNAPSHOT_FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sHHQQIIQ")
+ENTRY = struct.Struct("<HH")
+FORM = struct.Struct("<IH")
+OFFSET_SIZE = 4
+
+# One bit per dataset, a word present in several datasets is stored once with several bits set
+DATASET_TAGS: Dict[str, int] = {
+    "blacklist": 1 << 0,
+    "custom": 1 << 1,
+    "custom_old": 1 << 2,
+    "dictionary": 1 << 3,
+    "nicknames_set": 1 << 4,
+    "random_prefixes": 1 << 5,
+    "random_suffixes": 1 << 6,
+    "sorted_datasets": 1 << 7,
+    "trusted_usernames": 1 << 8,
+    "usernames": 1 << 9,
+}
+
+# The large corpora that never change at runtime, and are worth keeping out of Python sets
+SNAPSHOT_DATASET_KEYS = [
+    "custom_old",
+    "dictionary",
+    "sorted_datasets",
+    "trusted_usernames",
+]
+
+
+def source_files(
+    paths: Dict[str, Path], dataset_keys: List[str]
+) -> Dict[str, List[Path]]:
+    """
+    Maps each dataset to the JSON file(s) it's built from. `sorted_datasets` is a folder of files.
+    """
+    sources: Dict[str, List[Path]] = {}
+    for dataset_key in dataset_keys:
+        path = paths[dataset_key]
+        sources[dataset_key] = sorted(path.glob("*.json")) if path.is_dir() else [path]
+    return sources
+
+
+def source_fingerprint(sources: Dict[str, List[Path]]) -> int:
+    """
+    A cheap identity for the JSON sources (name, size, mtime), used to tell when a snapshot is stale.
+    """
+    digest = sha256()
+    for dataset_key in sorted(sources):
+        for path in sources[dataset_key]:
+            stat = path.stat()
+            digest.update(
+                f"{dataset_key}:{path.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode()
+            )
+    return int.from_bytes(digest.digest()[:8], "little")
+
+
+def build_snapshot(
+    datasets: Mapping[str, Iterable[str]],
+    path: Path,
+    fingerprint: int,
+    version: int = 0,
+    normalizer: Optional[Normalizer] = None,
+):
+    """
+    Writes every word in 'datasets' to a binary snapshot at 'path', tagged with the datasets it belongs to. With a
+    'normalizer', the normalized forms of the words are written too, so they never have to be computed at startup.
+    """
+    tags: Dict[str, int] = {}
+    for dataset_key, words in datasets.items():
+        tag = DATASET_TAGS[dataset_key]
+        for word in words:
+            tags[word] = tags.get(word, 0) | tag
+
+    encoded = sorted((word.encode("utf-8"), word, tag) for word, tag in tags.items())
+    offsets = bytearray()
+    entries = bytearray()
+    for word_bytes, _, tag in encoded:
+        offsets += len(entries).to_bytes(OFFSET_SIZE, "little")
+        entries += ENTRY.pack(tag, len(word_bytes))
+        entries += word_bytes
+
+    forms = (
+        form_entries((word for _, word, _ in encoded), normalizer)
+        if normalizer is not None
+        else []
+    )
+    for form_bytes, position in forms:
+        offsets += len(entries).to_bytes(OFFSET_SIZE, "little")
+        entries += FORM.pack(position, len(form_bytes))
+        entries += form_bytes
+
+    temp_path = path.with_name(f"{path.name}.tmp")
+    with open(temp_path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                SNAPSHOT_MAGIC,
+                SNAPSHOT_FORMAT_VERSION,
+                0,
+                fingerprint,
+                version,
+                len(encoded),
+                len(forms),
+                normalizer.fingerprint if normalizer is not None else 0,
+            )
+        )
+        f.write(offsets)
+        f.write(entries)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def build_snapshot_from_json(
+    sources: Dict[str, List[Path]],
+    path: Path,
+    version: int = 0,
+    normalizer: Optional[Normalizer] = None,
+):
+    datasets: Dict[str, List[str]] = {}
+    for dataset_key, documents in load_json_files(sources).items():
+        datasets[dataset_key] = [word for document in documents for word in document]
+    build_snapshot(datasets, path, source_fingerprint(sources), version, normalizer)
+    do_log(f"Built snapshot {path.as_posix()} ({', '.join(sources)})")
+
+
+class TaggedWordTable(Protocol):
+    """
+    A word table tagged with `DATASET_TAGS`, such as `MappedSnapshot` or `CompactWordTable`.
+    """
+
+    count: int
+    form_fingerprint: int
+
+    def flags(self, word: str) -> int:
+        ...
+
+    def word_at(self, position: int) -> str:
+        ...
+
+    def lookup_form(self, form: str, tag: int) -> Optional[str]:
+        ...
+
+    def iter_tagged(self, tag: int) -> Iterator[str]:
+        ...
+
+    def iter_tagged_positions(self, tag: int) -> Iterator[Tuple[int, str]]:
+        ...
+
+    def count_tagged(self, tag: int) -> int:
+        ...
+
+
+class MappedSnapshot:
+    """
+    A read-only, memory-mapped snapshot. Lookups binary search the mapped file directly, so no `str` objects are
+    created for words that are never asked about.
+    """
+
+    def __init__(self, path: Path):
+        if sys.byteorder != "little":
+            raise ValueError(
+                "Binary snapshots are only supported on little-endian hosts"
+            )
+
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            format_version,
+            _,
+            self.fingerprint,
+            self.version,
+            self.count,
+            self.form_count,
+            self.form_fingerprint,
+        ) = HEADER.unpack_from(self.mm, 0)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(
+                f"{path} is not a v{SNAPSHOT_FORMAT_VERSION} whitelist snapshot"
+            )
+
+        forms_start = HEADER.size + self.count * OFFSET_SIZE
+        self.entries_start = forms_start + self.form_count * OFFSET_SIZE
+        self.offsets = memoryview(self.mm)[HEADER.size : forms_start].cast("I")
+        self.form_offsets = memoryview(self.mm)[forms_start : self.entries_start].cast(
+            "I"
+        )
+        self.tag_counts: Optional[Dict[int, int]] = None
+
+    def flags(self, word: str) -> int:
+        """
+        Returns the dataset tag bitmask for 'word', or 0 if it's in none of them.
+        """
+        key = word.encode("utf-8")
+        mm = self.mm
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.entries_start + self.offsets[middle]
+            tag, length = ENTRY.unpack_from(mm, start)
+            probe = mm[start + ENTRY.size : start + ENTRY.size + length]
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                return tag
+        return 0
+
+    def word_at(self, position: int) -> str:
+        start = self.entries_start + self.offsets[position]
+        _, length = ENTRY.unpack_from(self.mm, start)
+        return self.mm[start + ENTRY.size : start + ENTRY.size + length].decode("utf-8")
+
+    def lookup_form(self, form: str, tag: int) -> Optional[str]:
+        """
+        Returns the word tagged with 'tag' that normalizes to 'form', if the snapshot was built with a normalizer.
+        """
+        key = form.encode("utf-8")
+        mm = self.mm
+        low, high = 0, self.form_count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.entries_start + self.form_offsets[middle]
+            position, length = FORM.unpack_from(mm, start)
+            probe = mm[start + FORM.size : start + FORM.size + length]
+            if probe < key:
+                low = middle + 1
+            elif probe > key:
+                high = middle
+            else:
+                entry_tag, _ = ENTRY.unpack_from(
+                    mm, self.entries_start + self.offsets[position]
+                )
+                return self.word_at(position) if entry_tag & tag else None
+        return None
+
+    def iter_tagged_positions(self, tag: int) -> Iterator[Tuple[int, str]]:
+        """
+        Yields `(position, word)` for every word tagged with 'tag', positions being stable for `word_at`.
+        """
+        mm = self.mm
+        for position, offset in enumerate(self.offsets):
+            start = self.entries_start + offset
+            entry_tag, length = ENTRY.unpack_from(mm, start)
+            if entry_tag & tag:
+                yield position, mm[
+                    start + ENTRY.size : start + ENTRY.size + length
+                ].decode("utf-8")
+
+    def iter_tagged(self, tag: int) -> Iterator[str]:
+        return (word for _, word in self.iter_tagged_positions(tag))
+
+    def count_tagged(self, tag: int) -> int:
+        if self.tag_counts is None:
+            self.tag_counts = {}
+            for offset in self.offsets:
+                entry_tag, _ = ENTRY.unpack_from(self.mm, self.entries_start + offset)
+                for dataset_tag in DATASET_TAGS.values():
+                    if entry_tag & dataset_tag:
+                        self.tag_counts[dataset_tag] = (
+                            self.tag_counts.get(dataset_tag, 0) + 1
+                        )
+        return self.tag_counts.get(tag, 0)
+
+
+class TaggedDatasetView(AbstractSet[str]):
+    """
+    A read-only set view of a single dataset inside a tagged word table, so it can stand in for a `Set[str]`.
+    """
+
+    def __init__(self, table: TaggedWordTable, dataset_key: str):
+        self.table = table
+        self.tag = DATASET_TAGS[dataset_key]
+
+    def __contains__(self, word: object) -> bool:
+        return isinstance(word, str) and bool(self.table.flags(word) & self.tag)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.table.iter_tagged(self.tag)
+
+    def __len__(self) -> int:
+        return self.table.count_tagged(self.tag)
+
+
+def main():
+    parser = ArgumentParser(
+        description="Builds the binary whitelist snapshot from the JSON datasets."
+    )
+    parser.add_argument(
+        "--config", help="Filepath for the config JSON file", default="config.json"
+    )
+    args = parser.parse_args()
+    with open(args.config, "r", encoding="utf-8") as config_file:
+        config = json.load(config_file)
+
+    data_path = Path(*config.get("data_path", ["..", "data"]))
+    paths = {
+        dataset_key: data_path / f"{dataset_key}.json"
+        for dataset_key in SNAPSHOT_DATASET_KEYS
+    }
+    paths["sorted_datasets"] = data_path / "sorted_datasets"
+    steps: Optional[List[str]] = config.get("normalization_steps")
+    build_snapshot_from_json(
+        source_files(paths, SNAPSHOT_DATASET_KEYS),
+        data_path / "snapshot.bin",
+        normalizer=Normalizer(steps, config.get("leet_map")) if steps != [] else None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import zlib
+from base64 import b64encode
+from hashlib import sha256
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import do_log
+
+
+class SnapshotBlob:
+    """
+    The full datasets for one version, serialized and compressed once, then split into base64 chunks ready to send.
+    """
+
+    def __init__(self, version: int, data: bytes, chunk_size: int):
+        self.version = version
+        self.size = len(data)
+        self.sha256 = sha256(data).hexdigest()
+        self.chunk_size = chunk_size
+        self.chunks: List[str] = [
+            b64encode(data[start : start + chunk_size]).decode("ascii")
+            for start in range(0, len(data), chunk_size)
+        ]
+
+    def metadata(self) -> Dict:
+        return {
+            "version": self.version,
+            "encoding": "zlib+json",
+            "sha256": self.sha256,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunks": len(self.chunks),
+        }
+
+
+def build_blob(version: int, datasets: Dict[str, Any], chunk_size: int) -> SnapshotBlob:
+    # Sorted so the same version always hashes the same, which also reads out any read-only views
+    datasets = {
+        key: value if isinstance(value, dict) else sorted(value)
+        for key, value in datasets.items()
+    }
+    data = zlib.compress(json.dumps(datasets, separators=(",", ":")).encode("utf-8"))
+    return SnapshotBlob(version, data, chunk_size)
+
+
+class SnapshotCache:
+    """
+    Holds the latest `SnapshotBlob`, only rebuilding it when the dataset version changes. Concurrent requests for a
+    new version wait on the same build.
+    - 'collect_func' is called on the event loop and must return the current version along with the datasets, as
+    dicts or iterables of words. Serializing and compressing happens on a worker thread, so anything that changes
+    meanwhile must be copied, while read-only datasets can be passed as they are.
+    """
+
+    def __init__(
+        self,
+        collect_func: Callable[[], Tuple[int, Dict[str, Any]]],
+        chunk_size: int = 262144,
+    ):
+        self.collect_func = collect_func
+        self.chunk_size = chunk_size
+        self.blob: Optional[SnapshotBlob] = None
+        self.lock = asyncio.Lock()
+
+    async def get(self, version: int) -> SnapshotBlob:
+        async with self.lock:
+            if self.blob is None or self.blob.version != version:
+                start_time = perf_counter()
+                version, datasets = self.collect_func()
+                self.blob = await asyncio.to_thread(
+                    build_blob, version, datasets, self.chunk_size
+                )
+                do_log(
+                    f"[Built v{version} snapshot ({self.blob.size} bytes, {len(self.blob.chunks)} chunks, "
+                    f"{(perf_counter() - start_time) * 1000:.0f}ms)]"
+                )
+            return self.blob
@@ -1,9 +1,14 @@
+import atexit
 import logging
+import sys
 from argparse import ArgumentParser
+from asyncio import Event
 from datetime import datetime
 from json import load as load_json
+from logging.handlers import QueueHandler, QueueListener
 from math import floor
-from typing import Any, Dict, List, TextIO, Tuple, Union
+from queue import Full, Queue
+from typing import Any, Dict, List, Optional, TextIO, Tuple, Union
 
 from discord import Guild as DiscordGuild
 from discord import Intents as DiscordIntents
@@ -15,6 +20,12 @@ from discord import Webhook as DiscordWebhook
 from discord.ext.commands import Bot as DiscordBot  # type: ignore
 from pytz import timezone
 
+# Building a pytz timezone isn't free, and every log line needs one
+EST_TIMEZONE = timezone("America/Toronto")
+UTC_TIMEZONE = timezone("UTC")
+TIME_FORMAT = "%Y-%b-%d %I:%M:%S %p EST"
+LOG_QUEUE_SIZE = 10000
+
 
 class BotClass:
     def __init__(self):
@@ -38,8 +49,20 @@ class BotClass:
         self.channels: Dict[str, DiscordChannel] = {}
         self.roles: Dict[str, DiscordRole] = {}
         self.ready = False
+        self.ready_event = Event()
+        self.discord_initialized = False
         do_log("Initialized Discord Client")
 
+    def set_ready(self, ready: bool):
+        """
+        Discord-bound work waits on `ready_event`, everything else only needs the `ready` flag.
+        """
+        self.ready = ready
+        if ready:
+            self.ready_event.set()
+        else:
+            self.ready_event.clear()
+
 
 def censor_text(text: str, leave_uncensored: int = 4) -> str:
     """
@@ -58,9 +81,9 @@ def get_est_time(datetime_to_convert: datetime = None) -> str:
     Gets the current time (or 'datetime_to_convert' arg, if provided) as datetime and converts it to a
     readable string
     """
-    desired_timezone = timezone("America/Toronto")
+    desired_timezone = EST_TIMEZONE
     if datetime_to_convert is not None:
-        input_timezone = timezone("UTC")
+        input_timezone = UTC_TIMEZONE
         if datetime_to_convert.tzinfo is not None:
             # TODO: Convert datetime tzinfo to pytz accordingly
             do_log("GET_EST_TIME ERROR, PLEASE IMPLEMENT CONVERTER")
@@ -70,26 +93,123 @@ def get_est_time(datetime_to_convert: datetime = None) -> str:
     else:
         output_datetime = datetime.now(desired_timezone)
 
-    return output_datetime.strftime("%Y-%b-%d %I:%M:%S %p EST")
+    return output_datetime.strftime(TIME_FORMAT)
+
+
+class ESTFormatter(logging.Formatter):
+    """
+    Formats record times in EST, reusing the last formatted timestamp while it's still the same second.
+    """
+
+    def __init__(self, fmt: str):
+        super().__init__(fmt)
+        self.cached_second = -1
+        self.cached_time = ""
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None):
+        second = int(record.created)
+        if second != self.cached_second:
+            self.cached_second = second
+            self.cached_time = datetime.fromtimestamp(second, EST_TIMEZONE).strftime(
+                TIME_FORMAT
+            )
+        return self.cached_time
 
 
-def do_log(message: str):
-    print(f"[{get_est_time()}] {message}")
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the logging thread as-is, so formatting happens there rather than on the event loop. If the
+    queue is full, records are dropped and counted instead of waiting.
+    """
+
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(
+                    logging.makeLogRecord(
+                        {
+                            "name": record.name,
+                            "levelno": logging.WARNING,
+                            "levelname": "WARNING",
+                            "msg": f"[Dropped {self.dropped} log records, logging queue was full]",
+                        }
+                    )
+                )
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+def setup_logging() -> Tuple[logging.Logger, QueueListener]:
+    """
+    Routes every `censor.*` logger through a queue to a background thread, which prints records and appends errors
+    to `errors.log`.
+    """
+    logger = logging.getLogger("censor")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    log_queue: Queue = Queue(LOG_QUEUE_SIZE)
+    logger.addHandler(NonBlockingQueueHandler(log_queue))
+
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(ESTFormatter("[%(asctime)s] %(message)s"))
+    error_handler = logging.FileHandler("errors.log", mode="a", delay=True)
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(ESTFormatter("[%(asctime)s]\n%(message)s"))
+
+    listener = QueueListener(
+        log_queue, stdout_handler, error_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)  # Drains whatever is still queued
+    return logger, listener
+
+
+LOGGER, LOG_LISTENER = setup_logging()
+SUBSYSTEM_LOGGERS: Dict[str, logging.Logger] = {}
+
+
+def get_subsystem_logger(subsystem: str) -> logging.Logger:
+    subsystem_logger = SUBSYSTEM_LOGGERS.get(subsystem)
+    if subsystem_logger is None:
+        subsystem_logger = LOGGER.getChild(subsystem)
+        SUBSYSTEM_LOGGERS[subsystem] = subsystem_logger
+    return subsystem_logger
+
+
+def set_log_levels(levels: Dict[str, str]):
+    """
+    Sets log levels per subsystem, which is the calling module's name (e.g. `cogs.websocket_manager`). The `root`
+    key sets the default for every subsystem without its own level.
+    """
+    for subsystem, level in levels.items():
+        target = LOGGER if subsystem == "root" else get_subsystem_logger(subsystem)
+        target.setLevel(level.upper())
+
+
+def do_log(message: str, level: int = logging.INFO, subsystem: Optional[str] = None):
+    """
+    Queues 'message' to be logged, never blocking on I/O. 'subsystem' defaults to the calling module's name.
+    """
+    if subsystem is None:
+        subsystem = sys._getframe(1).f_globals.get("__name__", "main")
+    subsystem_logger = get_subsystem_logger(subsystem)
+    if subsystem_logger.isEnabledFor(level):
+        subsystem_logger.log(level, message)
 
 
 def log_error(error: str):
     if "KeyboardInterrupt" in error:
         raise KeyboardInterrupt
-    error_message = f"[{get_est_time()}]\n{error}"
-    error_log_filename = "errors.log"
-    try:
-        with open(error_log_filename, "a") as error_log:
-            error_log.write(error_message)
-    except FileNotFoundError:
-        with open(error_log_filename, "w") as error_log:
-            error_message = f"[{get_est_time()}] WARNING: Failed to find existing error log. Writing to new.\n\n{error}"
-            error_log.write(error_message)
-    do_log(error_message)
+    do_log(error, logging.ERROR, sys._getframe(1).f_globals.get("__name__", "main"))
 
 
 async def try_delete_message(message: DiscordMessage):
@@ -1,11 +1,18 @@
+import asyncio
+import json
+import logging
+import os
+import shlex
+import signal
 from argparse import ArgumentParser
 from json import load as load_json
 from re import findall
 from subprocess import CalledProcessError, Popen, check_output  # nosec
-from time import sleep
-from typing import Dict
+from time import monotonic, sleep, time
+from typing import Dict, List, Optional
 
-from utils import do_log
+import websockets
+from utils import do_log, log_error
 
 
 def launch(config: Dict):
@@ -32,26 +39,307 @@ def check(config: Dict) -> bool:
     return True
 
 
-def main_loop(bot_config: Dict):
+def quit_screen(config: Dict):
+    try:
+        check_output(["screen", "-S", config["process_name"], "-X", "quit"])
+    except CalledProcessError:
+        pass  # Already gone
+
+
+class HealthProbe:
+    """
+    Probes the bot's `HEALTH` websocket function. A probe is unhealthy if it fails or times out, if the event loop
+    lag is over 'max_loop_lag_ms', or if Discord hasn't been ready for 'ready_timeout_seconds'. 'probe' returns a
+    reason to restart once 'failures_before_restart' probes in a row were unhealthy.
+    """
+
+    def __init__(self, config: Dict):
+        self.url: str = config.get("url", "ws://127.0.0.1:8087")
+        self.client_id: str = config.get("client_id", "")
+        self.interval: float = config.get("interval_seconds", 15)
+        self.timeout: float = config.get("timeout_seconds", 5)
+        self.startup_grace: float = config.get("startup_grace_seconds", 60)
+        self.max_loop_lag_ms: float = config.get("max_loop_lag_ms", 5000)
+        self.ready_timeout: float = config.get("ready_timeout_seconds", 300)
+        self.failures_before_restart: int = config.get("failures_before_restart", 3)
+        if not self.client_id:
+            # Every probe would be refused, restarting the bot forever
+            raise ValueError(
+                "Health checks need a client_id, or a ws_health_clients entry in the bot config"
+            )
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.not_ready_since: Optional[float] = None
+
+    async def request(self) -> Dict:
+        async with websockets.connect(  # type: ignore
+            self.url, open_timeout=self.timeout, close_timeout=1
+        ) as websocket:
+            await websocket.send(
+                json.dumps(
+                    {
+                        "id": self.client_id,
+                        "function": "HEALTH",
+                        "timestamp": f"watchdog_{str(time()).replace('.', '')}",
+                    }
+                )
+            )
+            response = json.loads(await websocket.recv())
+        # Anything but a HEALTH reply (an error, or an unexpected rate limit) is a failed probe, not a status
+        if response.get("message") != "HEALTH":
+            raise ValueError(f"unexpected {response.get('message')} response")
+        return response.get("data", {})
+
+    def evaluate(self, status: Dict) -> Optional[str]:
+        if status.get("loop_lag_ms", 0) > self.max_loop_lag_ms:
+            return f"event loop lag of {status['loop_lag_ms']}ms"
+        if status.get("ready"):
+            self.not_ready_since = None
+        elif self.not_ready_since is None:
+            self.not_ready_since = monotonic()
+        elif monotonic() - self.not_ready_since > self.ready_timeout:
+            return f"Discord not ready for over {self.ready_timeout:g}s"
+        return None
+
+    async def probe(self) -> Optional[str]:
+        try:
+            status = await asyncio.wait_for(self.request(), self.timeout)
+        except Exception as e:
+            problem: Optional[str] = f"probe failed ({e!r})"
+        else:
+            problem = self.evaluate(status)
+
+        if problem is None:
+            self.failures = 0
+            return None
+        self.failures += 1
+        do_log(
+            f"[Watchdog] Unhealthy ({self.failures}/{self.failures_before_restart}): {problem}",
+            logging.WARNING,
+        )
+        return problem if self.failures >= self.failures_before_restart else None
+
+
+def main_loop(bot_config: Dict, health: Optional[HealthProbe] = None):
     do_log("Started monitoring")
+    next_probe = monotonic() + (health.startup_grace if health is not None else 0)
     while True:
         bot_active = check(bot_config)
         if not bot_active:
             launch(bot_config)
+            if health is not None:
+                health.reset()
+                next_probe = monotonic() + health.startup_grace
+        elif health is not None and monotonic() >= next_probe:
+            problem = asyncio.run(health.probe())
+            next_probe = monotonic() + health.interval
+            if problem is not None:
+                log_error(
+                    f"[Watchdog] Restarting {bot_config['process_name']}: {problem}"
+                )
+                quit_screen(bot_config)
+                launch(bot_config)
+                health.reset()
+                next_probe = monotonic() + health.startup_grace
         sleep(1)
 
 
+def describe_exit(exit_code: int) -> str:
+    if exit_code < 0:
+        try:
+            return f"signal {signal.Signals(-exit_code).name}"
+        except ValueError:
+            return f"signal {-exit_code}"
+    return f"exit code {exit_code}"
+
+
+class Service:
+    """
+    A process run directly as a child of the supervisor. Its exit is awaited rather than polled for, and it's
+    restarted with exponential backoff, which resets once it has stayed up for 'reset_after_seconds'.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        config: Dict,
+        defaults: Dict,
+        health: Optional[HealthProbe] = None,
+        stop_timeout: float = 10,
+    ):
+        settings = {**defaults, **config}
+        self.name = name
+        self.directory = os.path.expanduser(os.path.expandvars(config["directory"]))
+        self.command = shlex.split(os.path.expandvars(config["launch_command"]))
+        self.initial_backoff: float = settings.get("initial_backoff_seconds", 1)
+        self.max_backoff: float = settings.get("max_backoff_seconds", 60)
+        self.reset_after: float = settings.get("reset_after_seconds", 60)
+        self.restart_on_clean_exit: bool = settings.get("restart_on_clean_exit", True)
+        self.health = health
+        self.stop_timeout = stop_timeout
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        self.last_exit_code: Optional[int] = None
+
+    async def launch(self) -> Optional[asyncio.subprocess.Process]:
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *self.command, cwd=self.directory
+            )
+        except OSError as e:
+            log_error(f"[Supervisor] Failed to launch {self.name}: {e}")
+            return None
+        do_log(f"[Supervisor] Started {self.name} (pid {self.process.pid})")
+        return self.process
+
+    async def run(self, stopping: asyncio.Event):
+        backoff = self.initial_backoff
+        while not stopping.is_set():
+            start_time = monotonic()
+            process = await self.launch()
+            if process is not None:
+                self.last_exit_code = await self.wait(process)
+                uptime = monotonic() - start_time
+                if stopping.is_set():
+                    break
+                exit_reason = describe_exit(self.last_exit_code)
+                message = f"[Supervisor] {self.name} exited with {exit_reason} after {uptime:.1f}s"
+                if self.last_exit_code == 0:
+                    do_log(message)
+                    if not self.restart_on_clean_exit:
+                        break
+                else:
+                    log_error(message)
+                if uptime >= self.reset_after:
+                    backoff = self.initial_backoff
+
+            do_log(f"[Supervisor] Restarting {self.name} in {backoff:g}s")
+            try:
+                await asyncio.wait_for(stopping.wait(), backoff)
+                break
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, self.max_backoff)
+            self.restarts += 1
+
+    async def wait(self, process: asyncio.subprocess.Process) -> int:
+        if self.health is None:
+            return await process.wait()
+        self.health.reset()
+        health_task = asyncio.create_task(self.watch_health(self.health))
+        try:
+            return await process.wait()
+        finally:
+            health_task.cancel()
+
+    async def watch_health(self, health: HealthProbe):
+        """
+        Stops the process once its health probe says so, which then restarts it like any other exit.
+        """
+        await asyncio.sleep(health.startup_grace)
+        while True:
+            problem = await health.probe()
+            if problem is not None:
+                log_error(f"[Supervisor] Restarting {self.name}: {problem}")
+                await self.stop(self.stop_timeout)
+                return
+            await asyncio.sleep(health.interval)
+
+    async def stop(self, timeout: float):
+        process = self.process
+        if process is None or process.returncode is not None:
+            return
+        do_log(f"[Supervisor] Stopping {self.name}")
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            do_log(f"[Supervisor] {self.name} didn't stop in {timeout:g}s, killing it")
+            process.kill()
+            await process.wait()
+
+
+def load_services(config: Dict) -> List[Service]:
+    """
+    Services come from the `services` block of the watchdog config, falling back to just the bot from `bot_vars`.
+    A service is health checked with the `health` block if its own `health` is true, or a dict of overrides.
+    """
+    health_config = config.get("health")
+    services_config = config.get("services") or {
+        "bot": {**config["bot_vars"], "health": health_config is not None}
+    }
+    defaults = config.get("restart_policy", {})
+    services = []
+    for name, service_config in services_config.items():
+        service_health = service_config.get("health", False)
+        health = None
+        if service_health:
+            overrides = service_health if isinstance(service_health, dict) else {}
+            health = HealthProbe({**(health_config or {}), **overrides})
+        services.append(
+            Service(
+                name,
+                service_config,
+                defaults,
+                health,
+                config.get("stop_timeout_seconds", 10),
+            )
+        )
+    return services
+
+
+async def supervise(services: List[Service], stop_timeout: float):
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stopping.set)
+
+    do_log(f"[Supervisor] Supervising {', '.join(s.name for s in services)}")
+    tasks = [asyncio.create_task(service.run(stopping)) for service in services]
+    # Returns early if every service exits for good
+    waiters: List[asyncio.Future] = [
+        asyncio.create_task(stopping.wait()),
+        asyncio.gather(*tasks),
+    ]
+    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    stopping.set()
+    await asyncio.gather(*(service.stop(stop_timeout) for service in services))
+    await asyncio.gather(*tasks)
+    do_log("[Supervisor] Stopped")
+
+
 def main_init():
     do_log("Initializing...")
     parser = ArgumentParser(description="Discord bot arguments.")
     parser.add_argument(
         "--config", help="Filepath for the config JSON file", default="config.json"
     )
+    parser.add_argument(
+        "--supervise",
+        help="Run the configured services as child processes, instead of polling screen sessions",
+        action="store_true",
+    )
     args = parser.parse_args()
     config_file_name = str(args.config)
     with open(config_file_name, "r", encoding="utf-8") as config_file:
         loaded_config = load_json(config_file)
     config = loaded_config["watchdog"]
+    if config.get("health") is not None:
+        # Probes go to the bot's own websocket server, as the first of its health-only clients
+        config["health"].setdefault(
+            "client_id", next(iter(loaded_config.get("ws_health_clients", [])), "")
+        )
+    if args.supervise:
+        asyncio.run(
+            supervise(load_services(config), config.get("stop_timeout_seconds", 10))
+        )
+        return
+    # Built before relaunching in a screen, so a bad health config fails right away
+    health_config = config.get("health")
+    health = HealthProbe(health_config) if health_config is not None else None
+
     config["bot_vars"]["process_name"] = (
         config["bot_vars"]["process_name"].replace(" ", "").lower()
     )
@@ -68,7 +356,7 @@ def main_init():
     bot_active = check(config["bot_vars"])
     do_log(f"Bot is {'active' if bot_active else 'inactive'}")
 
-    main_loop(config["bot_vars"])
+    main_loop(config["bot_vars"], health)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+import asyncio
+import re
+from time import perf_counter
+from typing import AbstractSet, Dict, FrozenSet, Iterable, List, Optional, Set
+
+from dataset_loader import LazyDataset
+from normalization import NormalizedIndex
+from snapshot import TaggedWordTable
+
+# Chat is tokenized the same way as the datasets are stored: lowercase, one word per entry
+TOKEN_PATTERN = re.compile(r"[\w']+")
+
+
+class WhitelistIndex:
+    """
+    A single, merged lookup structure over every whitelist dataset, so checking a word costs one lookup instead of
+    one per dataset.
+    - `base` is frozen at build time from the loaded datasets.
+    - `additions` holds words approved after the build, and is expected to stay small until the next restart.
+    - `snapshot` optionally covers the datasets kept in a binary snapshot or compact word table, matched against
+    `snapshot_mask`.
+    - `lazy_datasets` are only consulted on a miss. The first miss starts loading them on a worker thread, and until
+    then they match nothing, since reading them here would block the event loop. `load_lazy` waits for them.
+    - `normalized` optionally matches words by normalized form as well. A snapshot built with the same normalizer
+    is matched through the forms stored in it, otherwise its words are normalized here once. Lazy datasets aren't
+    part of it, and are only matched on a word's normalized form directly.
+    """
+
+    def __init__(
+        self,
+        datasets: Iterable[AbstractSet[str]],
+        snapshot: Optional[TaggedWordTable] = None,
+        snapshot_mask: int = 0,
+        lazy_datasets: Optional[List[LazyDataset]] = None,
+        normalized: Optional[NormalizedIndex] = None,
+    ):
+        start_time = perf_counter()
+        merged: Set[str] = set()
+        for dataset in datasets:
+            merged.update(dataset)
+        self.base: FrozenSet[str] = frozenset(merged)
+        self.additions: Set[str] = set()
+        self.snapshot = snapshot
+        self.snapshot_mask = snapshot_mask
+        self.lazy_datasets = lazy_datasets or []
+        self.normalized = normalized
+        self.form_table: Optional[TaggedWordTable] = None
+        if normalized is not None:
+            scanned: List[Iterable[str]] = [self.base]
+            if snapshot is not None:
+                if snapshot.form_fingerprint == normalized.normalizer.fingerprint:
+                    self.form_table = snapshot
+                else:
+                    scanned.append(snapshot.iter_tagged(snapshot_mask))
+            normalized.build(scanned)
+        self.build_time = perf_counter() - start_time
+
+        self.words_checked = 0
+        self.check_time = 0.0
+
+    def __contains__(self, word: object) -> bool:
+        if word in self.base or word in self.additions:
+            return True
+        if self.snapshot is not None and isinstance(word, str):
+            if self.snapshot.flags(word) & self.snapshot_mask:
+                return True
+        for dataset in self.lazy_datasets:
+            if not dataset.loaded:
+                dataset.start_loading()
+            elif word in dataset:
+                return True
+        return False
+
+    def __len__(self) -> int:
+        snapshot_count = self.snapshot.count if self.snapshot is not None else 0
+        return len(self.base) + len(self.additions) + snapshot_count
+
+    async def load_lazy(self):
+        """
+        Loads every lazy dataset on a worker thread, for callers that need an exact answer rather than a fast one.
+        """
+        await asyncio.gather(*(dataset.load() for dataset in self.lazy_datasets))
+
+    def add(self, word: str):
+        if word not in self.base:
+            self.additions.add(word)
+        if self.normalized is not None:
+            self.normalized.add(word)
+
+    def match(self, word: str) -> Optional[str]:
+        """
+        Returns the whitelisted entry 'word' stands for, either itself or one sharing its normalized form, or None if
+        there isn't one.
+        """
+        if word in self:
+            return word
+        form = (
+            word.lower()
+            if self.normalized is None
+            else self.normalized.normalizer(word)
+        )
+        if form != word and form in self:
+            return form
+        if self.normalized is None:
+            return None
+        canonical = self.normalized.get(form)
+        if canonical is None and self.form_table is not None:
+            canonical = self.form_table.lookup_form(form, self.snapshot_mask)
+        return canonical
+
+    @property
+    def words_per_second(self) -> float:
+        if self.check_time <= 0:
+            return 0.0
+        return self.words_checked / self.check_time
+
+    def check_text(self, text: str) -> Dict:
+        """
+        Tokenizes 'text' and returns every word not found in the whitelist, along with a censored copy of the text
+        where each unknown word is replaced by asterisks of the same length.
+        """
+        start_time = perf_counter()
+        unknown: List[str] = []
+        word_count = 0
+
+        def censor_match(match: re.Match) -> str:
+            nonlocal word_count
+            word_count += 1
+            word = match.group(0)
+            if self.match(word) is not None:
+                return word
+            unknown.append(word)
+            return "*" * len(word)
+
+        censored = TOKEN_PATTERN.sub(censor_match, text)
+
+        self.words_checked += word_count
+        self.check_time += perf_counter() - start_time
+        return {"unknown": unknown, "censored": censored}
+
+    def check_texts(self, texts: List[str]) -> List[Dict]:
+        return [self.check_text(text) for text in texts]